@@ -0,0 +1,116 @@
+"""
+Benchmark of the Chase et al. (2021) retrieval on one granule: time per orbit and peak memory.
+
+Compares the old pre/post-processing (deepcopies, -9999 filled copies, full size outputs) with the
+compact-index one in GPMDPR.run_Chase2021, all at once and in blocks. Each one runs in its own process
+so the peak RSS of one does not hide the others.
+
+usage::
+python benchmarks/chase2021.py /path/to/2A.GPM.DPR.V9-20211125.20220220-S003549-E020820.045337.V07A.HDF5 --models_path drpy/models/
+"""
+import argparse
+import copy
+import multiprocessing
+import resource
+import time
+import numpy as np
+import xarray as xr
+
+def legacy(dpr,bundle):
+    """ the pre/post-processing run_Chase2021 used to do (with the numpy model so only the processing differs) """
+    model = bundle['model']
+    scaler_X = bundle['scaler_X']
+    scaler_y = bundle['scaler_y']
+    Ku = copy.deepcopy(dpr.ds.zFactorFinal[:,:,:,0].values)
+    Ka = copy.deepcopy(dpr.ds.zFactorMeasured[:,:,:,1].values)
+    T = copy.deepcopy(dpr.ds.airTemperature.values)
+    T = T - 273.15
+    shape_step1 = Ku.shape
+    Ku = Ku.reshape([Ku.shape[0]*Ku.shape[1]*Ku.shape[2]])
+    Ka = Ka.reshape([Ka.shape[0]*Ka.shape[1]*Ka.shape[2]])
+    T = T.reshape([T.shape[0]*T.shape[1]*T.shape[2]])
+    Ku[np.isnan(Ka)] = np.nan
+    Ka[np.isnan(Ku)] = np.nan
+    Ku[T>0] = np.nan
+    Ku[(Ku-Ka) < -0.5] = np.nan
+    ind_masked = np.isnan(Ku)
+    Ku_nomask = np.ones(Ku.shape)*-9999.
+    Ka_nomask = np.ones(Ka.shape)*-9999.
+    T_nomask = np.ones(T.shape)*-9999.
+    Ku_nomask[~ind_masked] = Ku[~ind_masked]
+    Ka_nomask[~ind_masked] = Ka[~ind_masked]
+    T_nomask[~ind_masked] = T[~ind_masked]
+    ind = np.where(Ku_nomask!=-9999.)[0]
+    X = np.zeros([Ku_nomask.shape[0],3])
+    X[:,0] = (Ku_nomask - scaler_X.mean_[0])/scaler_X.scale_[0]
+    X[:,1] = ((Ku_nomask - Ka_nomask)- scaler_X.mean_[1])/scaler_X.scale_[1]
+    X[:,2] = (T_nomask - scaler_X.mean_[2])/scaler_X.scale_[2]
+    yhat = model.predict(X[ind,0:3],batch_size=len(X[ind,0]))
+    yhat[:,0] = (yhat[:,0]*scaler_y.scale_[0]) + scaler_y.mean_[0]
+    yhat[:,1] = (yhat[:,1]*scaler_y.scale_[1]) + scaler_y.mean_[1]
+    yhat[:,2] = (yhat[:,2]*scaler_y.scale_[2]) + scaler_y.mean_[2]
+    yhat[:,1] = 10**yhat[:,1]
+    yhat[:,2] = 10**yhat[:,2]
+    ind = np.where(Ku_nomask!=-9999.)[0]
+    dims = ['nscan','nrayNS','nbin']
+    Nw = np.zeros(Ku_nomask.shape)
+    Nw[ind] = np.squeeze(yhat[:,0])
+    Nw = Nw.reshape(shape_step1)
+    Nw[Nw==0.0] = np.nan
+    dpr.ds['Nw_nn'] = xr.DataArray(Nw,dims=dims)
+    Dm = np.zeros(Ku_nomask.shape)
+    Dm[ind] = np.squeeze(yhat[:,1])
+    Dm = Dm.reshape(shape_step1)
+    Dm[Dm==0.0] = np.nan
+    dpr.ds['Dml_nn'] = xr.DataArray(Dm,dims=dims)
+    Dm_frozen = np.zeros(Ku_nomask.shape)
+    Dm_frozen[ind] = np.squeeze(yhat[:,2])
+    Dm_frozen = Dm_frozen.reshape(shape_step1)
+    Dm_frozen[Dm_frozen==0.0] = np.nan
+    dpr.ds['Dms_nn'] = xr.DataArray(Dm_frozen,dims=dims)
+    Nw = 10**Nw
+    Dm = Dm/1000.
+    IWC = (Nw*(Dm)**4*1000*np.pi)/4**(4)
+    IWC = IWC*1000
+    dpr.ds['IWC_nn'] = xr.DataArray(IWC,dims=dims)
+    R = 3.64*(IWC**1.06)
+    dpr.ds['R_nn'] = xr.DataArray(R,dims=dims)
+
+def run(mode,filename,models_path,memory_budget,queue):
+    import drpy
+    bundle = drpy.core.get_model(models_path,backend='numpy')
+    dpr = drpy.core.GPMDPR(filename=filename)
+    #load the inputs first so every mode starts from the same place
+    for name in ['zFactorFinal','zFactorMeasured','airTemperature']:
+        dpr.ds[name].load()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t = time.perf_counter()
+    if mode == 'legacy':
+        legacy(dpr,bundle)
+    elif mode == 'fused':
+        dpr.run_Chase2021_blocks(bundle)
+    else:
+        dpr.run_Chase2021_blocks(bundle,memory_budget=memory_budget)
+    seconds = time.perf_counter() - t
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    n = int(np.isfinite(dpr.ds.Dml_nn.values).sum())
+    queue.put((mode,seconds,(after - before)/1024.,n,float(np.nansum(dpr.ds.R_nn.values))))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('filename')
+    parser.add_argument('--models_path',default='drpy/models/')
+    parser.add_argument('--memory_budget',type=float,default=64,help='MB, for the blocks run')
+    parser.add_argument('--repeat',type=int,default=3)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    print('{:>8} {:>10} {:>14} {:>10} {:>14}'.format('mode','s/orbit','peak RSS [MB]','gates','sum R'))
+    for mode in ['legacy','fused','blocks']:
+        for i in range(args.repeat):
+            queue = ctx.Queue()
+            p = ctx.Process(target=run,args=(mode,args.filename,args.models_path,args.memory_budget,queue))
+            p.start()
+            result = queue.get()
+            p.join()
+            print('{:>8} {:>10.3f} {:>14.1f} {:>10d} {:>14.6g}'.format(*result))
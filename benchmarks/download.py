@@ -0,0 +1,50 @@
+"""
+Benchmark of netrunner downloads against the local fake PPS server (benchmarks/fake_pps.py).
+
+Downloads one day of fake granules with different numbers of workers and prints the throughput.
+With --flaky every file gets cut off halfway the first time, to see how much resuming saves: MB is what
+went over the wire, which is just the size of the files if only the missing bytes are asked for again.
+
+usage::
+python benchmarks/download.py --size 20 --n_granules 16
+"""
+import argparse
+import datetime
+import os
+import shutil
+import tempfile
+import time
+from fake_pps import FakePPSServer
+import drpy
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size',type=float,default=20,help='MB in each fake granule')
+    parser.add_argument('--n_granules',type=int,default=16)
+    parser.add_argument('--workers',type=int,nargs='+',default=[1,2,4,8])
+    parser.add_argument('--flaky',action='store_true',help='cut off the first download of each file')
+    args = parser.parse_args()
+
+    server = FakePPSServer(0,int(args.size*2**20),args.n_granules,details=True).start()
+    day = datetime.datetime(2022,2,20)
+    print('{:>8} {:>8} {:>10} {:>10} {:>10}'.format('workers','files','MB','seconds','MB/s'))
+    for n_workers in args.workers:
+        savedir = tempfile.mkdtemp()
+        server.flaky = args.flaky
+        server.was_cut = set()
+        try:
+            io = drpy.io.netrunner(servername='Research',username='user@email.com',start_time=day,
+                                   end_time=day + datetime.timedelta(hours=23,minutes=59),autorun=False,verbose=False,
+                                   n_workers=n_workers,server=server.url)
+            io.get_file_list()
+            io.locate_file()
+            t = time.perf_counter()
+            results = io.download(savedir=savedir)
+            seconds = time.perf_counter() - t
+            mb = sum([r.nbytes for r in results])/2**20
+            assert all([r.ok for r in results])
+            assert len(os.listdir(savedir)) == len(results)
+            print('{:>8d} {:>8d} {:>10.1f} {:>10.2f} {:>10.1f}'.format(n_workers,len(results),mb,seconds,mb/seconds))
+        finally:
+            shutil.rmtree(savedir)
+    server.shutdown()
@@ -0,0 +1,194 @@
+"""
+A stand-in for the PPS text servers, for trying out (and timing) downloads without the internet.
+
+It serves directory listings like the real servers (one path per line) for
+
+    /text/gpmdata/YYYY/MM/DD/radar/      (Research)
+    /text/radar/DprL2/                   (NearRealTime)
+
+and fake 2A.DPR granules of random bytes (behind an HDF5 signature) at the paths in them. Connections are
+kept alive (HTTP/1.1), HEAD and Range requests work, listings can carry the size, md5 and last modified time
+of each file (change server.cache/server.modified to make a file change), flaky=True cuts off the first
+download of every file halfway (to try out resuming), and rate caps each download (bytes/s) like a slow link.
+
+usage::
+python benchmarks/fake_pps.py --port 8000 --size 50
+then point netrunner at it with server='http://127.0.0.1:8000/text'
+"""
+import argparse
+import datetime
+import hashlib
+import http.server
+import os
+import re
+import sys
+import threading
+import time
+
+def granule_names(date,n=16,nrt=False):
+    """ names of n fake 2A.DPR granules spread over one day, named like on the Research or (nrt=True) NearRealTime server """
+    names = []
+    for i in range(n):
+        start = datetime.datetime(date.year,date.month,date.day) + datetime.timedelta(seconds=i*86400//n)
+        end = start + datetime.timedelta(seconds=86400//n - 1)
+        times = '{}-S{}-E{}'.format(start.strftime('%Y%m%d'),start.strftime('%H%M%S'),end.strftime('%H%M%S'))
+        if nrt:
+            #no orbit number, and a different ending
+            names.append('2A.GPM.DPR.V920211125.{}.V07A.RT-H5'.format(times))
+        else:
+            names.append('2A.GPM.DPR.V9-20211125.{}.{:06d}.V07A.HDF5'.format(times,40000+i))
+    return names
+
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+def granule_bytes(name,size):
+    """ the (repeatable) random contents of a fake granule """
+    block = hashlib.sha256(name.encode()).digest()*2048
+    return (HDF5_SIGNATURE + block*(size//len(block) + 1))[:size]
+
+class FakePPSHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self,*args):
+        pass
+
+    def send_body(self,body,content_type='application/octet-stream',ranged=False):
+        total = len(body)
+        start = 0
+        match = re.match(r'bytes=(\d+)-$',self.headers.get('Range','')) if ranged else None
+        if match is not None:
+            start = int(match.group(1))
+            if start >= total:
+                self.send_response(416)
+                self.send_header('Content-Range','bytes */{}'.format(total))
+                self.send_header('Content-Length','0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range','bytes {}-{}/{}'.format(start,total - 1,total))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type',content_type)
+        self.send_header('Content-Length',str(total - start))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        body = body[start:]
+        if ranged and self.server.cut(self.path):
+            #send half and hang up
+            self.wfile.write(body[:len(body)//2])
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        rate = self.server.rate
+        if rate is None:
+            self.wfile.write(body)
+            return
+        #a slow link, 1/10 s worth of bytes at a time
+        step = max(int(rate/10),1)
+        for i in range(0,len(body),step):
+            self.wfile.write(body[i:i + step])
+            time.sleep(step/rate)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        self.server.requests += 1
+        path = self.path.split('?')[0]
+        research = re.match(r'^/text/gpmdata/(\d{4})/(\d{2})/(\d{2})/radar/$',path)
+        nrt = path == '/text/radar/DprL2/'
+        if research or nrt:
+            if research:
+                date = datetime.date(*[int(x) for x in research.groups()])
+                prefix = '/gpmdata/{:04d}/{:02d}/{:02d}/radar/'.format(date.year,date.month,date.day)
+                names = granule_names(date,self.server.n_granules)
+            else:
+                date = datetime.date.today()
+                prefix = '/radar/DprL2/'
+                names = granule_names(date,self.server.n_granules,nrt=True)
+            if self.server.details:
+                lines = []
+                for name in names:
+                    body = self.server.contents(name)
+                    lines.append('{} {} md5:{} {}'.format(prefix + name,len(body),hashlib.md5(body).hexdigest(),
+                                                          self.server.modified.get(name,date.isoformat() + 'T00:00:00')))
+            else:
+                lines = [prefix + name for name in names]
+            listing = '\n'.join(lines) + '\n'
+            self.send_body(listing.encode(),'text/plain')
+            return
+        if path.startswith('/text/') and path.endswith(('.HDF5','.RT-H5')):
+            self.send_body(self.server.contents(os.path.basename(path)),ranged=True)
+            return
+        self.send_error(404)
+
+class FakePPSServer(http.server.ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self,port=0,size=2**20,n_granules=16,details=False,flaky=False,rate=None):
+        """
+        params::
+        port: int, port to listen on (0 picks a free one)
+        size: int, bytes in each fake granule
+        n_granules: int, granules listed for each day
+        details: bool, put the size, md5 and last modified time of each file in the listings
+        flaky: bool, cut off the first download of each file halfway through
+        rate: float, bytes/s each download is held to (None for as fast as it goes)
+        """
+        http.server.ThreadingHTTPServer.__init__(self,('127.0.0.1',port),FakePPSHandler)
+        self.size = size
+        self.n_granules = n_granules
+        self.details = details
+        self.flaky = flaky
+        self.rate = rate
+        self.requests = 0
+        self.cache = {}
+        self.modified = {}
+        self.lock = threading.Lock()
+        self.was_cut = set()
+
+    def handle_error(self,request,client_address):
+        #clients hanging up partway (timeouts, cancelled downloads) are expected
+        if not isinstance(sys.exc_info()[1],ConnectionError):
+            http.server.ThreadingHTTPServer.handle_error(self,request,client_address)
+
+    def cut(self,path):
+        """ True if this download should be cut off """
+        with self.lock:
+            if (not self.flaky) or (path in self.was_cut):
+                return False
+            self.was_cut.add(path)
+            return True
+
+    def contents(self,name):
+        if name not in self.cache:
+            self.cache[name] = granule_bytes(name,self.size)
+        return self.cache[name]
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/text'.format(self.server_address[1])
+
+    def start(self):
+        """ serve in a background thread """
+        thread = threading.Thread(target=self.serve_forever,daemon=True)
+        thread.start()
+        return self
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port',type=int,default=8000)
+    parser.add_argument('--size',type=float,default=50,help='MB in each fake granule')
+    parser.add_argument('--n_granules',type=int,default=16)
+    parser.add_argument('--details',action='store_true',help='put sizes and md5s in the listings')
+    parser.add_argument('--flaky',action='store_true',help='cut off the first download of each file')
+    parser.add_argument('--rate',type=float,default=None,help='MB/s each download is held to')
+    args = parser.parse_args()
+    server = FakePPSServer(args.port,int(args.size*2**20),args.n_granules,args.details,args.flaky,
+                           None if args.rate is None else args.rate*2**20)
+    print('Serving fake PPS at {}'.format(server.url))
+    server.serve_forever()
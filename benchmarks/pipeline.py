@@ -0,0 +1,84 @@
+"""
+Benchmark of drpy.io.Pipeline against downloading everything and then processing it, using the local fake PPS
+server (benchmarks/fake_pps.py) held to a slow rate so downloading takes a while.
+
+The processing is a stand-in that burns CPU for a fixed time per file. With the pipeline the total should come
+out near max(download, process) instead of download + process.
+
+usage::
+python benchmarks/pipeline.py --size 8 --n_granules 16 --rate 8 --work 0.5
+"""
+import argparse
+import datetime
+import os
+import shutil
+import tempfile
+import time
+import hashlib
+from fake_pps import FakePPSServer
+import drpy
+
+WORK = 0.5
+
+def work(path):
+    """ read the file and hash it over and over for WORK seconds """
+    with open(path,'rb') as f:
+        data = f.read()
+    t = time.perf_counter()
+    n = 0
+    while time.perf_counter() - t < WORK:
+        hashlib.sha256(data[:2**20]).hexdigest()
+        n += 1
+    return n
+
+def init(seconds):
+    global WORK
+    WORK = seconds
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size',type=float,default=8,help='MB in each fake granule')
+    parser.add_argument('--n_granules',type=int,default=16)
+    parser.add_argument('--rate',type=float,default=8,help='MB/s each download is held to')
+    parser.add_argument('--work',type=float,default=0.5,help='seconds of processing per file')
+    parser.add_argument('--workers',type=int,default=2,help='files downloaded (and processed) at once')
+    args = parser.parse_args()
+    init(args.work)
+
+    server = FakePPSServer(0,int(args.size*2**20),args.n_granules,details=True,rate=args.rate*2**20).start()
+    day = datetime.datetime(2022,2,20)
+    def runner():
+        io = drpy.io.netrunner(servername='Research',username='user@email.com',start_time=day,
+                               end_time=day + datetime.timedelta(hours=23,minutes=59),autorun=False,verbose=False,
+                               n_workers=args.workers,server=server.url)
+        io.get_file_list()
+        io.locate_file()
+        return io
+
+    print('{:>12} {:>10} {:>10}'.format('mode','seconds','files'))
+    savedir = tempfile.mkdtemp()
+    try:
+        io = runner()
+        t = time.perf_counter()
+        results = io.download(savedir=savedir)
+        download = time.perf_counter() - t
+        for result in results:
+            work(result.path)
+        total = time.perf_counter() - t
+        print('{:>12} {:>10.2f} {:>10d}'.format('download',download,len(results)))
+        print('{:>12} {:>10.2f} {:>10d}'.format('process',total - download,len(results)))
+        print('{:>12} {:>10.2f} {:>10d}'.format('sequential',total,len(results)))
+    finally:
+        shutil.rmtree(savedir)
+
+    savedir = tempfile.mkdtemp()
+    try:
+        io = runner()
+        t = time.perf_counter()
+        p = drpy.io.Pipeline(io,work,savedir=savedir,prefetch=2*args.workers,n_workers=args.workers,processes=False)
+        total = time.perf_counter() - t
+        assert len(os.listdir(savedir)) == 0
+        print('{:>12} {:>10.2f} {:>10d}'.format('pipeline',total,len(p.results)))
+    finally:
+        shutil.rmtree(savedir)
+    server.shutdown()
@@ -1,2 +1,8 @@
 from __future__ import absolute_import
-from .core import GPMDPR
\ No newline at end of file
+from .core import GPMDPR
+from .collection import GPMDPRCollection
+from .index import GranuleIndex
+from .registry import ModelRegistry, get_model
+from .inference import NumpyModel, export_npz
+from .retrieval import ChaseRetrieval
+from .cache import RetrievalCache
\ No newline at end of file
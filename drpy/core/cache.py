@@ -0,0 +1,165 @@
+from __future__ import absolute_import
+import functools
+import hashlib
+import os
+import shutil
+import xarray as xr
+
+@functools.lru_cache(maxsize=64)
+def hash_file(filename,mtime=None,size=None):
+    """ sha1 of the contents of a file. mtime and size are only there so a changed file is hashed again """
+    h = hashlib.sha1()
+    with open(filename,'rb') as f:
+        for block in iter(lambda: f.read(2**20),b''):
+            h.update(block)
+    return h.hexdigest()
+
+def granule_digest(filename,memo_dir=None):
+    """
+    sha1 of the contents of a granule, so the same orbit is known by the same key wherever it is (copied, moved or 
+    touched). It is only worked out once per (path, modification time, size): in this process by hash_file, and across 
+    processes if memo_dir is given (a small file per granule is kept in memo_dir/digests). 
+    """
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    memo = None
+    if memo_dir is not None:
+        stamp = hashlib.sha1(repr([filename,stat.st_mtime,stat.st_size]).encode()).hexdigest()
+        memo = os.path.join(memo_dir,'digests',stamp)
+        try:
+            with open(memo) as f:
+                return f.read().strip()
+        except OSError:
+            pass
+    digest = hash_file(filename,stat.st_mtime,stat.st_size)
+    if memo is not None:
+        os.makedirs(os.path.dirname(memo),exist_ok=True)
+        tmp = memo + '.tmp' + str(os.getpid())
+        with open(tmp,'w') as f:
+            f.write(digest)
+        os.replace(tmp,memo)
+    return digest
+
+def write_zarr(ds,path):
+    """
+    Write ds to a zarr store at path without ever leaving half a store there: it is written somewhere else first
+    and then moved. If path is already there (e.g., another process beat us to it) nothing is written. 
+    """
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+    ds = ds.copy()
+    for v in ds.variables:
+        ds[v].encoding = {}
+    tmp = path + '.tmp' + str(os.getpid())
+    ds.to_zarr(tmp,mode='w')
+    try:
+        os.rename(tmp,path)
+    except OSError:
+        #someone else beat us to it
+        shutil.rmtree(tmp,ignore_errors=True)
+    return path
+
+def hash_files(filenames):
+    """ one sha1 for the contents of a few files (e.g., a model and its scalers) """
+    h = hashlib.sha1()
+    for filename in filenames:
+        stat = os.stat(filename)
+        h.update(hash_file(os.path.abspath(filename),stat.st_mtime,stat.st_size).encode())
+    return h.hexdigest()
+
+def model_files(models_path,model_name='NN_6by8.h5'):
+    """ the files a model bundle is loaded from (an .npz has the scalers in it) """
+    if model_name.endswith('.npz'):
+        return [os.path.join(models_path,model_name)]
+    return [os.path.join(models_path,model_name),os.path.join(models_path,'scaler_X.pkl'),
+            os.path.join(models_path,'scaler_y.pkl')]
+
+def dir_size(path):
+    """ bytes used by everything under path """
+    total = 0
+    for root,dirs,files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root,name))
+            except OSError:
+                pass
+    return total
+
+class RetrievalCache():
+
+    """
+    A folder of retrieval outputs (one zarr store per key), so a retrieval only has to be run once per granule
+    and model. Entries are reopened lazily. When the folder gets bigger than max_size, the entries used longest
+    ago are deleted.
+    """
+
+    def __init__(self,cache_dir,max_size=2**30):
+        """
+        params::
+        cache_dir: str, folder to keep the outputs in
+        max_size: int, bytes. Oldest entries are dropped past this (None means no limit)
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def path(self,key):
+        return os.path.join(self.cache_dir,key + '.zarr')
+
+    def get(self,key):
+        """ reopen the outputs saved under key (as dask arrays), None if there are none """
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        #mark it as just used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return xr.open_zarr(path)
+
+    def put(self,key,ds):
+        """ save a dataset under key, then make room if the cache is too big """
+        path = self.path(key)
+        if os.path.exists(path):
+            return path
+        write_zarr(ds,path)
+        self.evict(keep=path)
+        return path
+
+    def entries(self):
+        """ list of (last used, bytes, path) of every entry, oldest first """
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir,name)
+            if not name.endswith('.zarr'):
+                continue
+            try:
+                entries.append((os.path.getmtime(path),dir_size(path),path))
+            except OSError:
+                pass
+        return sorted(entries)
+
+    def evict(self,keep=None):
+        """ delete the entries used longest ago until the cache fits in max_size. Returns the number deleted """
+        if self.max_size is None:
+            return 0
+        entries = self.entries()
+        total = sum([size for mtime,size,path in entries])
+        n = 0
+        for mtime,size,path in entries:
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path,ignore_errors=True)
+            total -= size
+            n += 1
+        return n
+
+    def clear(self):
+        """ delete everything in the cache """
+        for mtime,size,path in self.entries():
+            shutil.rmtree(path,ignore_errors=True)
@@ -0,0 +1,95 @@
+from __future__ import absolute_import
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import xarray as xr
+from .core import GPMDPR
+
+class GPMDPRCollection():
+
+    """
+    This class reads a bunch of GPM-DPR granules at once and stacks them along nscan into one
+    (lazy) xarray dataset, so a month of files can be worked with like one big array.
+
+    Each granule is read with GPMDPR, so bounding_box, variables, heavy and chunks all work
+    the same way they do there. A 'granule' coordinate (the file name) along nscan tells you
+    where each scan came from.
+    """
+
+    def __init__(self,filenames=[],bounding_box=None,variables=None,heavy=True,chunks='auto',n_workers=8,auto_run=True):
+        """
+        Initializes things
+
+        params::
+        filenames: list of str or str, paths to GPM-DPR files, or a glob pattern (e.g., '/data/2A.GPM.DPR.*.HDF5'). 
+        Can also be a dict of filename -> list of (start,stop) scan ranges (e.g., from GranuleIndex.query), 
+        then only those scans are read 
+        bounding_box: list of floats, [lon_min,lon_max,lat_min,lat_max]. Only scans through the box are read
+        variables: list of str, only load these variables (see GPMDPR)
+        heavy: bool, load all the groups (see GPMDPR)
+        chunks: 'auto' or int, dask chunks along nscan. Keep this set, otherwise every granule is loaded
+        into RAM when they get stacked
+        n_workers: int, number of threads used to open granules at the same time
+        """
+        if isinstance(filenames,str):
+            filenames = sorted(glob.glob(filenames))
+        self.scans = {}
+        if isinstance(filenames,dict):
+            self.scans = filenames
+        self.filenames = list(filenames)
+        self.corners = bounding_box
+        self.variables = variables
+        self.heavy = heavy
+        self.chunks = chunks
+        self.n_workers = n_workers
+
+        if auto_run:
+            #read all the granules
+            self.read()
+            #stack them along nscan
+            self.concat()
+
+    def read_one(self,filename):
+        """ read a single granule, returns None if it cant be read """
+        try:
+            return GPMDPR(filename=filename,bounding_box=self.corners,variables=self.variables,
+                          heavy=self.heavy,chunks=self.chunks,scans=self.scans.get(filename))
+        except Exception as e:
+            print('Warning, could not read {}: {}'.format(filename,e))
+            return None
+
+    def read(self):
+        """
+        This method opens all the granules at the same time in a thread pool. Threads are used (not processes)
+        because the data stay lazy and need the open file handles to live in this process.
+        """
+        with ThreadPoolExecutor(max_workers=self.n_workers) as pool:
+            granules = list(pool.map(self.read_one,self.filenames))
+
+        #keep the ones that read ok and have scans (a bounding box might not touch every granule)
+        self.granules = [dpr for dpr in granules if (dpr is not None) and (dpr.ds.sizes['nscan'] > 0)]
+
+    def concat(self):
+        """
+        This method stacks all the granules along nscan. With dask chunks on this is lazy, nothing is read
+        until you ask for it.
+        """
+        if len(self.granules) == 0:
+            print('Warning, no granules to stack')
+            self.ds = None
+            return
+
+        dss = []
+        for dpr in self.granules:
+            ds = dpr.ds
+            name = os.path.basename(str(dpr.filename))
+            ds = ds.assign_coords(granule=('nscan',np.repeat(name,ds.sizes['nscan'])))
+            dss.append(ds)
+
+        self.ds = xr.concat(dss,dim='nscan',data_vars='minimal',coords='minimal',compat='override')
+
+    def close(self):
+        """ close all the hdf5 files """
+        for dpr in self.granules:
+            dpr.close()
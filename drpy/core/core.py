@@ -1,13 +1,175 @@
 from __future__ import absolute_import
 import xarray as xr 
+from xarray.backends import BackendArray
+from xarray.core import indexing
+import h5py
 import numpy as np
 import pandas as pd
 import datetime
 import os
+import hashlib
+import ast
+from .products import get_layout, get_product, name_dims
+from .registry import get_model
+from . import inference
+from .cache import RetrievalCache, hash_files, model_files, granule_digest, write_zarr
+from ..util import geo
 #turn off warnings so i can use the progressbar
 import warnings
 warnings.filterwarnings('ignore')
 
+#bump this if what read() or parse_dtime() puts in the dataset changes, so old zarr caches are not used 
+CACHE_VERSION = 3
+
+def native_scan_chunks(layouts,chunks='auto'):
+    """
+    Figures out how many scans to put in each dask chunk so the dask chunks line up with 
+    the hdf5 chunks on disk (i.e., no hdf5 chunk gets read/decompressed by more than one dask chunk). 
+
+    params::
+    layouts: list of (shape,dtype,chunksizes) for each variable, chunksizes is None for contiguous variables 
+    chunks: 'auto' to grow the native chunk until the biggest variable hits dask's array.chunk-size, 
+    or an int number of scans that will be rounded up to a multiple of the native chunk 
+    """
+    nscan = max([shape[0] for shape,dtype,chunksizes in layouts])
+    native = [chunksizes[0] for shape,dtype,chunksizes in layouts if chunksizes is not None]
+    #smallest nscan chunk that is a whole number of every variable's native chunk 
+    base = int(np.lcm.reduce(native)) if len(native) > 0 else 1
+    base = min(base,nscan)
+
+    if chunks == 'auto':
+        import dask
+        from dask.utils import parse_bytes
+        target = parse_bytes(dask.config.get('array.chunk-size'))
+        bytes_per_scan = max([np.dtype(dtype).itemsize*int(np.prod(shape[1:])) for shape,dtype,chunksizes in layouts])
+        n = base*max(1,target//(base*bytes_per_scan))
+    else:
+        n = base*int(np.ceil(chunks/base))
+
+    return int(min(n,nscan))
+
+class DPRArray(BackendArray):
+    """
+    Thin wrapper around one h5py dataset so xarray can lazily index it. Only the 
+    piece of the hdf5 file you slice out is ever read. 
+    """
+    def __init__(self,dset):
+        self.dset = dset
+        self.shape = dset.shape
+        self.dtype = dset.dtype
+
+    def __getitem__(self,key):
+        #h5py can handle slices and one (sorted) list of indices, xarray takes care of the rest in memory 
+        return indexing.explicit_indexing_adapter(key,self.shape,indexing.IndexingSupport.OUTER_1VECTOR,self.dset.__getitem__)
+
+def get_group_dims(group,schema):
+    """
+    Works out the dimension names of every dataset in an hdf5 group, without opening it with netCDF. 
+
+    GPM files have no dimension scales, so netCDF makes up 'phony' dims: going through the datasets in order,
+    each axis reuses the first phony dim with the same length (that isnt already used by that dataset), 
+    otherwise a new one is made. This does the same thing and then swaps in the proper names from the 
+    product layout (see products.name_dims). 
+
+    returns a dict of dataset name -> tuple of dimension names 
+    """
+    lengths = []
+    ids = {}
+    for key in group:
+        dset = group[key]
+        if not isinstance(dset,h5py.Dataset):
+            continue
+        ids[key] = []
+        for n in dset.shape:
+            match = [i for i,l in enumerate(lengths) if (l == n) and (i not in ids[key])]
+            if len(match) > 0:
+                ids[key].append(match[0])
+            else:
+                lengths.append(n)
+                ids[key].append(len(lengths)-1)
+    names = name_dims(lengths,schema)
+    return {key:tuple([names[i] for i in ids[key]]) for key in ids}
+
+def get_layout_dims(group,names,known,schema):
+    """
+    Dimension names of some datasets in an hdf5 group, straight from the product layout. Only if a dataset is not in
+    the layout (or its shape does not fit it) is the whole group worked out with get_group_dims. 
+
+    params::
+    group: h5py group
+    names: list of str, the datasets you want
+    known: dict of dataset name -> tuple of (name,length), the variable dims of this group from the layout 
+    schema: list of (name,length), the group dims from the layout (for get_group_dims)
+
+    returns a dict of dataset name -> tuple of dimension names 
+    """
+    dims = {}
+    found = None
+    for name in names:
+        dset = group[name]
+        if not isinstance(dset,h5py.Dataset):
+            continue
+        axes = known.get(name)
+        if (axes is not None) and (len(axes) == len(dset.shape)) and all([(l is None) or (l == n) for (d,l),n in zip(axes,dset.shape)]):
+            dims[name] = tuple([d for d,l in axes])
+            continue
+        if found is None:
+            found = get_group_dims(group,schema)
+        dims[name] = found[name]
+    return dims
+
+def get_attrs(dset):
+    """ grab the hdf5 attributes, turning bytes into str and length-1 arrays into scalars like netCDF does """
+    attrs = {}
+    for key,value in dset.attrs.items():
+        if key in ['DIMENSION_LIST','REFERENCE_LIST','CLASS','NAME']:
+            continue
+        if isinstance(value,bytes):
+            value = value.decode('utf-8','replace')
+        elif isinstance(value,np.ndarray) and value.size == 1:
+            value = value.reshape(-1)[0]
+            if isinstance(value,bytes):
+                value = value.decode('utf-8','replace')
+        attrs[key] = value
+    return attrs
+
+def get_scan_ranges(lat,lon,corners):
+    """
+    Finds the contiguous runs of scans that have at least one ray inside a lat lon box.
+
+    params::
+    lat: 2d np.array, dim = (nscan,nrayNS)
+    lon: 2d np.array, dim = (nscan,nrayNS)
+    corners: list of floats, [lon_min,lon_max,lat_min,lat_max]
+
+    returns a list of (start,stop) scan indices, stop is not included (like a python slice)
+    """
+    inside = (lon >= corners[0]) & (lon <= corners[1]) & (lat >= corners[2]) & (lat <= corners[3])
+    return mask_to_ranges(np.any(inside,axis=1))
+
+def mask_to_ranges(mask):
+    """ turn a 1d boolean array (one per scan) into a list of (start,stop) ranges of the True runs """
+    #+1 where a run starts, -1 one past where it ends 
+    edges = np.diff(np.concatenate([[0],np.asarray(mask).astype(int),[0]]))
+    starts = np.where(edges == 1)[0]
+    stops = np.where(edges == -1)[0]
+    return [(int(start),int(stop)) for start,stop in zip(starts,stops)]
+
+def ranges_to_mask(ranges,nscan):
+    """ turn a list of (start,stop) ranges into a 1d boolean array of length nscan """
+    mask = np.zeros(nscan,dtype=bool)
+    for start,stop in ranges:
+        mask[start:stop] = True
+    return mask
+
+def ranges_to_index(ranges):
+    """ turn a list of (start,stop) scan ranges into something isel can use (a slice if there is only one) """
+    if len(ranges) == 1:
+        return slice(ranges[0][0],ranges[0][1])
+    if len(ranges) == 0:
+        return np.array([],dtype=int)
+    return np.concatenate([np.arange(start,stop) for start,stop in ranges])
+
 class GPMDPR():
 
     """
@@ -20,118 +182,244 @@ class GPMDPR():
     For your reference, please check out GPM-DPR's ATBD: https://pps.gsfc.nasa.gov/GPMprelimdocs.html 
     """
 
-    def __init__(self,filename=[],bounding_box=None,outer_swath=False,auto_run=True,heavy=True): 
+    def __init__(self,filename=[],bounding_box=None,outer_swath=False,auto_run=True,heavy=True,variables=None,chunks=None,scans=None,
+                 cache_dir=None,swath=None): 
         """
         Initializes things
 
         params::
-        filename: str, path to GPM-DPR file 
+        filename: str, path to GPM-DPR file. Can also be a file-like object (e.g., a buffer in memory from 
+        netrunner.stream), see detach to let go of it once the parts you want are loaded 
         boundingbox: list of floats, if you would like to cut the gpm to a lat lon box 
-        send in a list of [lon_min,lon_mat,lat_min,lat_max]
+        send in a list of [lon_min,lon_mat,lat_min,lat_max]. Only the scans that go through 
+        the box are read (see setboxcoords to also nan out the points outside it)
+        variables: list of str, only load these variables (e.g., ['zFactorFinalNearSurface','precipRateNearSurface']). 
+        Latitude, Longitude and the scan time are always loaded. If given, this overrides the heavy flag. 
+        chunks: None, 'auto' or int, if set the data are loaded as dask arrays chunked along nscan to match 
+        the hdf5 chunks on disk. 'auto' picks the chunk size for you, an int is the number of scans per chunk. 
+        scans: list of (start,stop) scan ranges, only read these scans (e.g., from GranuleIndex.query). 
+        If a bounding_box is also given, only scans in both are read. 
+        cache_dir: str, folder for a zarr copy of the read-in dataset. The first time a file is read (with these options) 
+        it is written there, every time after that it is reopened from there, which is much faster. 
+        swath: str, which swath to read (e.g., 'FS' or 'HS' for V7, 'NS', 'MS' or 'HS' for V6). Defaults to the 
+        full swath of whatever product the file is (see products.PRODUCTS) 
         """
         self.filename = filename
         self.corners = bounding_box
         self.heavy=heavy
+        self.variables = variables
+        self.chunks = chunks
+        self.scans = scans
+        self.cache_dir = cache_dir
+        self.swath = swath
         
         if auto_run:
+            #if this file has been cached before, just reopen that 
+            if (self.cache_dir is not None) and self.from_zarr_cache():
+                return
             #this reads the hdf5 file 
             self.read()
-            #this gets a datetime obj for each scan 
+            #this gets a datetime obj for each scan (an empty time if the box cut out every scan, so the dataset looks the same)
             self.parse_dtime()
+            #save it for next time 
+            if self.cache_dir is not None:
+                self.to_zarr_cache()
         
     def read(self):
         """
         This method unfolds all the groups into one combined xarray dataset for
         each radar (e.g., KuPR and KaPR). It will be lazily loaded to save on RAM.
-        Note that this code was primarily developed for V7 DPR products. It will not 
-        work for V6 data 
+        Both V7 and V6 products are read (V6 swaths are NS, MS and HS, and its groups and 
+        variables differ a bit, see products.VARIABLES) 
+
+        The file is opened once with h5py and kept open (see self.close) so the data can be 
+        loaded lazily. Group and dimension names come from the product layout (see products.py), 
+        so nothing needs to be merged or aligned. Use self.swath to pick a swath other than the full one.
+
+        If self.variables is set, only the groups holding those variables are opened 
+        and everything else is skipped before anything is read. The geolocation and scan time 
+        are always kept so the rest of the class still works.
+
+        If self.chunks is set, every variable becomes a dask array chunked along nscan, 
+        so nothing is pulled into RAM until you ask for it (e.g., .values or .compute()).
+
+        If self.corners (or self.scans) is set, only the scans that go through the box are kept (self.scan_ranges 
+        has the (start,stop) scans that were read). 
 
         """
         #######################################################################
         ################################ KuPR #################################
         #######################################################################
 
-        prefix = '/FS/'
-        geo = xr.open_dataset(self.filename,group=prefix,engine='netcdf4',decode_cf=False)
-        pre = xr.open_dataset(self.filename,group=prefix+'PRE',engine='netcdf4',decode_cf=False)
-        slv = xr.open_dataset(self.filename,group=prefix+'SLV',engine='netcdf4',decode_cf=False)
-        tim = xr.open_dataset(self.filename,group=prefix+'ScanTime',engine='netcdf4',decode_cf=False)
-
-        #rename dims to proper names
-        bad_dims = list(geo.dims)
-        geo = geo.rename_dims({bad_dims[0]:'nscan',
-                            bad_dims[1]:'nrayNS'})
-        bad_dims = list(pre.dims)
-        pre = pre.rename_dims({bad_dims[0]:'nscan',
-                            bad_dims[1]:'nrayNS',
-                            bad_dims[2]:'nfreq',
-                            bad_dims[3]:'nbin'})
-        bad_dims = list(slv.dims)
-        slv = slv.rename_dims({bad_dims[0]:'nscan',
-                            bad_dims[1]:'nrayNS',
-                            bad_dims[2]:'nbin',
-                            bad_dims[3]:'nfreq',
-                            bad_dims[4]:'nNUBF'})
-        bad_dims = list(tim.dims)
-        tim = tim.rename_dims({bad_dims[0]:'nscan'})
+        #open the file once and build the dataset straight from the groups, no merging needed 
+        self.h5 = h5py.File(self.filename,'r')
+
+        #look up the layout of this product, so we know the group and dimension names up front
+        self.product,self.version = get_product(self.h5,getattr(self.filename,'name',self.filename))
+        self.layout = get_layout(self.product,self.version,self.swath)
+        prefix = '/' + self.layout['swath'] + '/'
+        groups = self.get_groups()
+        if self.variables is not None:
+            #always keep geolocation and scan time (needed for parse_dtime)
+            keep = set(self.variables) | set(self.layout['always'])
+
+        #if there is a box, read lat/lon first and only keep the scans that touch the box 
+        self.scan_ranges = None
+        if self.scans is not None:
+            self.scan_ranges = [tuple(r) for r in self.scans]
+        if (self.corners is not None) and (len(self.corners) > 0):
+            box_ranges = get_scan_ranges(self.h5[prefix+'Latitude'][:],self.h5[prefix+'Longitude'][:],self.corners)
+            if self.scan_ranges is not None:
+                #only the scans asked for AND in the box 
+                nscan = self.h5[prefix+'Latitude'].shape[0]
+                box_ranges = mask_to_ranges(ranges_to_mask(box_ranges,nscan) & ranges_to_mask(self.scan_ranges,nscan))
+            self.scan_ranges = box_ranges
+            if len(self.scan_ranges) == 0:
+                print('Warning, no scans go through the bounding box. The dataset will be empty')
+        if self.scan_ranges is not None:
+            scans = ranges_to_index(self.scan_ranges)
+
+        variables = {}
+        for group in groups:
+            if prefix+group not in self.h5:
+                print('Warning, no {} group in this file, skipping it'.format(prefix+group))
+                continue
+            grp = self.h5[prefix+group]
+            #get the proper dim names for each variable (only the ones we were asked for)
+            names = list(grp) if self.variables is None else [name for name in grp if name in keep]
+            dims = get_layout_dims(grp,names,self.layout['variable_dims'].get(group,{}),self.layout['dims'][group])
+
+            layouts = []
+            group_vars = {}
+            for name in dims:
+                dset = grp[name]
+                group_vars[name] = xr.Variable(dims[name],indexing.LazilyIndexedArray(DPRArray(dset)),
+                                               attrs=get_attrs(dset),encoding={'chunksizes':dset.chunks})
+                layouts.append((dset.shape,dset.dtype,dset.chunks))
+
+            #chunk things with dask (lazy) along nscan, lined up with the chunks on disk
+            if (self.chunks is not None) and (len(layouts) > 0):
+                n = native_scan_chunks(layouts,self.chunks)
+                for name in group_vars:
+                    if 'nscan' in group_vars[name].dims:
+                        group_vars[name] = group_vars[name].chunk({'nscan':n})
+            #crop to the scans in the box. Still lazy, so only those hyperslabs get read
+            if self.scan_ranges is not None:
+                for name in group_vars:
+                    if 'nscan' in group_vars[name].dims:
+                        group_vars[name] = group_vars[name].isel(nscan=scans)
+            variables.update(group_vars)
+
+        self.ds = xr.Dataset(variables)
         
-        #if you want to load the whole thing in, turn the heavy flag on 
-        if self.heavy: 
-            ver = xr.open_dataset(self.filename,group=prefix+'VER',engine='netcdf4',decode_cf=False)
-            srt = xr.open_dataset(self.filename,group=prefix+'SRT',engine='netcdf4',decode_cf=False)
-            csf = xr.open_dataset(self.filename,group=prefix+'CSF',engine='netcdf4',decode_cf=False)
-            exp = xr.open_dataset(self.filename,group=prefix+'Experimental',engine='netcdf4',decode_cf=False)
-            flg = xr.open_dataset(self.filename,group=prefix+'FLG',engine='netcdf4',decode_cf=False)
-            #rename dims to proper names
-            bad_dims = list(ver.dims)
-            ver = ver.rename_dims({bad_dims[0]:'nscan',
-                                bad_dims[1]:'nrayNS',
-                                bad_dims[2]:'nbin',
-                                bad_dims[3]:'nfreq',
-                                bad_dims[4]:'nNP'})
-            bad_dims = list(srt.dims)
-            srt = srt.rename_dims({bad_dims[0]:'nscan',
-                                bad_dims[1]:'nrayNS',
-                                bad_dims[2]:'method',
-                                bad_dims[3]:'foreBack',
-                                bad_dims[4]:'nearFar',
-                                bad_dims[5]:'nsdew'})
-            bad_dims = list(csf.dims)
-            csf = csf.rename_dims({bad_dims[0]:'nscan',
-                                bad_dims[1]:'nrayNS',
-                                bad_dims[2]:'nfreqHI'})
-            bad_dims = list(exp.dims)
-            exp = exp.rename_dims({bad_dims[0]:'nscan',
-                                bad_dims[1]:'nrayNS',
-                                bad_dims[2]:'nbinSZP',
-                                bad_dims[3]:'nfreq'}) 
-            bad_dims = list(flg.dims)
-            flg = flg.rename_dims({bad_dims[0]:'nscan',
-                                bad_dims[1]:'nrayNS',
-                                bad_dims[2]:'nbin',
-                                bad_dims[3]:'nfreq'})       
-
-            #MERGE into one ds 
-            self.ds = xr.merge([geo,pre,slv,ver,srt,csf,exp,flg,tim])
+        #set lat,lon,height as the coords to allow for easy xr slicing
+        self.ds = self.ds.set_coords([v for v in ['Latitude','Longitude','height'] if v in self.ds])
+
+    def close(self):
+        """ close the hdf5 file. Anything in self.ds not loaded into RAM yet can't be read after this """
+        if getattr(self,'h5',None) is not None:
+            self.h5.close()
+            self.h5 = None
+
+    def detach(self):
+        """
+        Load self.ds into RAM and close the file. Only what was read in (the variables asked for, cut to the box) is 
+        kept, so when the granule came from a buffer in memory the buffer can be let go right after this. 
+        """
+        self.ds = self.ds.load()
+        self.close()
+        if not isinstance(self.filename,str):
+            #don't hang on to the buffer 
+            self.filename = os.path.basename(str(getattr(self.filename,'name','granule')))
+        return self
+
+    def file_id(self,memo_dir=None):
+        """
+        (file name, what identifies this file) for the cache keys. Files are known by a hash of their bytes, so the same 
+        granule gets the same key wherever it is. For files on disk the hash is only worked out once per path, modification 
+        time and size (see cache.granule_digest, memo_dir keeps it for other processes too). 
+        """
+        if isinstance(self.filename,str):
+            return os.path.basename(self.filename),[granule_digest(self.filename,memo_dir)]
+        f = self.filename
+        h = hashlib.sha1()
+        if hasattr(f,'getbuffer'):
+            with f.getbuffer() as view:
+                h.update(view)
         else:
-            #MERGE into one ds 
-            self.ds = xr.merge([geo,pre,slv,tim])
-        
+            position = f.tell()
+            f.seek(0)
+            for block in iter(lambda: f.read(2**22),b''):
+                h.update(block)
+            f.seek(position)
+        return os.path.basename(str(getattr(f,'name','granule'))),[h.hexdigest()]
+
+    def cache_path(self,cache_dir=None):
+        """
+        Where the zarr cache of this file lives. The name is a hash of the file (see file_id) and the read options, 
+        so changing any of them means a new cache. 
+        """
+        if cache_dir is None:
+            cache_dir = self.cache_dir
+        name,file_id = self.file_id(cache_dir)
+        options = file_id + [CACHE_VERSION,self.swath,self.heavy,
+                             None if self.variables is None else sorted(self.variables),self.corners,self.scans]
+        key = hashlib.sha1(repr(options).encode()).hexdigest()
+        return os.path.join(cache_dir,name + '.' + key[:16] + '.zarr')
+
+    def to_zarr_cache(self,cache_dir=None):
+        """
+        This method writes self.ds (already renamed and time-parsed) to a chunked, compressed zarr store 
+        so the next GPMDPR(...,cache_dir=cache_dir) of this file can skip all the hdf5 work. 
+        """
+        if cache_dir is None:
+            cache_dir = self.cache_dir
+        path = self.cache_path(cache_dir)
+        if os.path.exists(path):
+            return path
+        #zarr wants even chunks, so rechunk along nscan in multiples of the hdf5 chunks 
+        layouts = [(self.ds[v].shape,self.ds[v].dtype,self.ds[v].encoding.get('chunksizes')) for v in self.ds.variables if 'nscan' in self.ds[v].dims]
+        ds = self.ds.chunk({'nscan':native_scan_chunks(layouts,'auto')}) if self.ds.sizes['nscan'] > 0 else self.ds.copy()
+        #remember which scans were read (zarr attrs need to be json, so store it as a string)
+        ds.attrs['drpy_scan_ranges'] = repr(getattr(self,'scan_ranges',None))
+
+        #written somewhere else first and then moved, so nobody ever opens half a cache 
+        return write_zarr(ds,path)
+
+    def from_zarr_cache(self,cache_dir=None):
+        """ 
+        This method reopens self.ds from the zarr cache, if there is one. Returns True if it found one. 
+        The data come back as dask arrays, nothing is read until you ask for it. 
+        """
+        path = self.cache_path(cache_dir)
+        if not os.path.exists(path):
+            return False
+        #mask_and_scale off to keep the raw values, like read() does 
+        self.ds = xr.open_zarr(path,mask_and_scale=False)
+        #zarr gives times back in ns, make them ms again like parse_dtime 
+        if 'time' in self.ds.coords:
+            self.ds['time'] = self.ds.time.astype('datetime64[ms]')
+        self.scan_ranges = ast.literal_eval(self.ds.attrs.pop('drpy_scan_ranges','None'))
+        return True
+
+    def get_groups(self):
+        """
+        This method figures out which groups need to be opened. With no variables given, 
+        this is set by the heavy flag. Otherwise each variable is looked up in the layout's variable map. 
+        """
+        layout = self.layout
+        if self.variables is None:
+            if self.heavy:
+                return layout['heavy']
+            return layout['light']
 
-        #close uneeded xr datasets 
-        geo.close()
-        pre.close()
-        slv.close()
-        tim.close()
-        if self.heavy: 
-          ver.close()
-          srt.close()
-          csf.close()
-          exp.close()
-          flg.close()
-        
-        #set lat,lon,height as the coords to allow for easy xr slicing
-        self.ds = self.ds.set_coords(['Latitude','Longitude','height'])
+        unknown = [v for v in self.variables if v not in layout['variables']]
+        if len(unknown) > 0:
+            raise ValueError('Unknown variable(s) {}. Known variables are listed in drpy.core.products.VARIABLES'.format(unknown))
+
+        needed = set(layout['variables'][v] for v in list(self.variables) + layout['always'])
+        #keep the usual group order so the dataset looks the same
+        return [g for g in layout['heavy'] if g in needed]
 
     def setboxcoords(self):
         """
@@ -145,87 +433,102 @@ class GPMDPR():
             self.ds = self.ds.where((self.ds.Longitude >= self.ll_lon) & (self.ds.Longitude <= self.ur_lon) & (self.ds.Latitude >= self.ll_lat)  & (self.ds.Latitude <= self.ur_lat),drop=False)
         else:
             print('ERROR, no boxcoods set...did you mean to do this?')
-    def parse_dtime(self):
-        year = self.ds.Year.values
-        ind = np.where(year == -9999)[0]
-        year = np.asarray(year,dtype=str)
-        year = list(year)
-
-        month = self.ds.Month.values
-        month = np.asarray(month,dtype=str)
-        month = np.char.rjust(month, 2, fillchar='0')
-        month = list(month)
-
-        day = self.ds.DayOfMonth.values
-        day = np.asarray(day,dtype=str)
-        day = np.char.rjust(day, 2, fillchar='0')
-        day = list(day)
-
-        hour = self.ds.Hour.values
-        hour = np.asarray(hour,dtype=str)
-        hour = np.char.rjust(hour, 2, fillchar='0')
-        hour = list(hour)
-
-        minute = self.ds.Minute.values
-        minute = np.asarray(minute,dtype=str)
-        minute = np.char.rjust(minute, 2, fillchar='0')
-        minute = list(minute)
-
-        second = self.ds.Second.values
-        second = np.asarray(second,dtype=str)
-        second = np.char.rjust(second, 2, fillchar='0')
-        second = list(second)
-
-        millisecond = self.ds.MilliSecond.values
-        millisecond = np.asarray(millisecond,dtype=str)
-        millisecond = np.char.rjust(millisecond, 3, fillchar='0')
-        millisecond = list(millisecond)
-
-        datestr  = [year[i] +"-"+ month[i]+ "-" + day[i] + \
-                    ' ' + hour[i] + ':' + minute[i] + ':' + second[i] + '.' + millisecond[i] for i in range(len(year))]
-        datestr = np.asarray(datestr,dtype=str)
-        datestr[ind] = '1970-01-01 00:00:00'
-        datestr = np.reshape(datestr,[len(datestr),1])
-        datestr = np.tile(datestr,(1,49))
-
-        self.ds['time'] = xr.DataArray(np.asarray(datestr,dtype=np.datetime64),dims=['nscan','nrayNS'])
+    def parse_dtime(self,broadcast=False):
+        """
+        This method turns the ScanTime fields (Year, Month, ..., MilliSecond) into one datetime64[ms] per scan. 
+        It is done with integer math on the fields (no strings), and stored as a 1d 'time' coordinate along nscan. 
+
+        params::
+        broadcast: bool, if True time is instead a (nscan,nrayNS) view of the 1d times for older code 
+        that wants a time for every ray (no copies are made) 
+        """
+        fields = {}
+        for name in ['Year','Month','DayOfMonth','Hour','Minute','Second','MilliSecond']:
+            fields[name] = self.ds[name].values.astype(np.int64)
+        #missing scans are -9999, set these to 1970-01-01 00:00:00 
+        bad = fields['Year'] == -9999
+        for name in fields:
+            fields[name][bad] = 0
+        fields['Year'][bad] = 1970
+        fields['Month'][bad] = 1
+        fields['DayOfMonth'][bad] = 1
+
+        #months since 1970 gives the start of the month, then add up the rest in ms 
+        months = (fields['Year'] - 1970)*12 + (fields['Month'] - 1)
+        ms = ((((fields['DayOfMonth'] - 1)*24 + fields['Hour'])*60 + fields['Minute'])*60 + fields['Second'])*1000 + fields['MilliSecond']
+        time = months.astype('datetime64[M]').astype('datetime64[ms]') + ms.astype('timedelta64[ms]')
+
+        time = xr.DataArray(time,dims=['nscan'])
+        if broadcast:
+            time = time.broadcast_like(self.ds.Latitude)
+        self.ds['time'] = time
         self.ds = self.ds.set_coords('time')
         #drop the variables we dont need 
         self.ds = self.ds.drop(['Year','Month','DayOfMonth','Hour','Minute','Second','MilliSecond','DayOfYear','SecondOfDay'])
 
-    def get_physcial_distance(self,reference_point = None):
+    def get_physcial_distance(self,reference_point=None,method='aeqd',along_track=True):
         """ 
-        This method uses pyproj to calcualte distances between lats and lons. 
-        reference_point is a list or array conisting of two entries, [Longitude,Latitude]
+        This method calculates the distance from a reference point to every ray (see drpy.util.geo). 
+        reference_point is a list or array conisting of two entries, [Longitude,Latitude]. It can also be 
+        many points, shape (npoint,2), then distance gets an extra npoint dim. 
+
+        params::
+        reference_point: [Longitude,Latitude] or array of them 
+        method: str, 'aeqd' (azimuthal equidistant projection with pyproj, what was always used) or 'haversine' (numpy only)
+        along_track: bool, also add the distance along the track for every ray as a coordinate (see get_along_track_distance)
+        """
+        if reference_point is None:
+            reference_point = getattr(self,'reference_point',None)
+        if reference_point is None:
+            print('Error, no reference point found...please enter one')
+            return
+        self.reference_point = reference_point
+
+        lon = self.ds.Longitude.values
+        lat = self.ds.Latitude.values
+        if 'zFactorFinalNearSurface' in self.ds:
+            #only keep rays that have data 
+            ind = np.isnan(self.ds.zFactorFinalNearSurface.values[:,:,0])
+            lon = np.where(ind,np.nan,lon)
+            lat = np.where(ind,np.nan,lat)
         
-        Please note that this intentionally uses an older version of pyproj (< version 2.0, i used 1.9.5.1)
-        This is because it preserves how the function is called. 
+        d = geo.distance_from(lon,lat,reference_point,method=method)
+        dims = list(self.ds.Latitude.dims)
+        if d.ndim > len(dims):
+            dims = ['npoint'] + dims
+        da = xr.DataArray(d, dims=dims)
+        da.attrs['units'] = 'km'
+        da.attrs['standard_name'] = 'distance, way of the crow (i.e. direct), to the reference point'
+        self.ds['distance'] = da
+
+        if along_track:
+            self.get_along_track_distance()
+
+    def get_along_track_distance(self):
+        """ 
+        This method adds the distance along the track (cumulative, from the first scan) for every ray as 
+        the along_track coordinate. Handy as an x-axis for cross-sections.
         """
+        da = xr.DataArray(geo.along_track_distance(self.ds.Longitude.values,self.ds.Latitude.values), dims=self.ds.Latitude.dims)
+        da.attrs['units'] = 'km'
+        da.attrs['standard_name'] = 'distance along the track from the first scan'
+        self.ds = self.ds.assign_coords(along_track=da)
 
-        if reference_point is None and self.reference_point is None:
-            print('Error, no reference point found...please enter one')
-        else:
-            #this is envoke the pyproj package. Please note this must be an old version** < 2.0 
-            from pyproj import Proj
-            p = Proj(proj='aeqd', ellps='WGS84', datum='WGS84', lat_0=reference_point[1], lon_0=reference_point[0])
-            #double check to make sure this returns 0 meters
-            x,y = p(reference_point[0],reference_point[1])
-            if np.sqrt(x**2 + y**2) != 0:
-                'something isnt right with the projection. investigate'
-            else:
-                ind = np.isnan(self.ds.zFactorFinalNearSurface.values[:,:,0])
-                x = np.zeros(self.ds.Longitude.values.shape)
-                y = np.zeros(self.ds.Latitude.values.shape)
-                x[~ind],y[~ind] = p(self.ds.Longitude.values[~ind],self.ds.Latitude.values[~ind])
-                x[ind] = np.nan
-                y[ind] = np.nan
-                da = xr.DataArray(np.sqrt(x**2 + y**2)/1000, dims=['nscan', 'nrayNS'])
-                da.attrs['units'] = 'km'
-                da.attrs['standard_name'] = 'distance, way of the crow (i.e. direct), to the reference point'
-                self.ds['distance'] = da
-    def run_Chase2021(self,models_path='../models/'):
+    def run_Chase2021(self,models_path='../models/',model_name='NN_6by8.h5',backend='numpy',memory_budget=None,batch_size=65536,
+                      cache_dir=None,cache_size=2**30):
     
-        """ Method to run Chase et al. (2021) JAMC Neural Network retrieval. THIS NEEDS TENSORFLOW!
+        """ Method to run Chase et al. (2021) JAMC Neural Network retrieval. 
+
+        params::
+        models_path: str, folder with the model and scalers 
+        model_name: str, the keras model (NN_6by8.h5), or an .npz made with drpy.core.inference.export_npz
+        backend: str, 'numpy' runs the network with numpy (see drpy.core.inference), 'keras' runs it with TENSORFLOW 
+        memory_budget: float, MB. If set, the granule is done a block of scans at a time so the working memory stays 
+        under about this much (on top of the float32 outputs). Use this for big, rainy granules 
+        batch_size: int, number of gates sent through the network at once 
+        cache_dir: str, folder to keep the outputs in. If this granule (read the same way) has been run with the same 
+        model before, the outputs are reopened lazily from there instead of being run again 
+        cache_size: int, bytes. The outputs used longest ago are deleted when cache_dir gets bigger than this 
         
         Outputs:
         ========
@@ -236,118 +539,92 @@ class GPMDPR():
         Dms_nn: 2d np.array, dim = (along_track,range), unit = mm, name= solid phase mass weighted mean diameter  
         Nw_nn: 2d np.array, dim = (along_track,range), unit = log(m^-4), name= liquid eq. normalized intercept parameter  
         IWC_nn: 2d np.array, dim = (along_track,range), unit = g m^{-3}, name= ice water content 
+        R_nn: 2d np.array, dim = (along_track,range), unit = mm hr^{-1}, name= liquid eq. precipitation rate 
         
+        All are float32 and nan where the retrieval was not run (warm or missing gates). 
         ========
         """
-        import pickle
-        import copy
-
-        try:
-            import tensorflow as tf
-        except:
-            print("No Tensorflow. Please go install it with conda")
-
-        with open(models_path+ 'scaler_X.pkl', 'rb') as inp:
-            scaler_X = pickle.load(inp)
-
-        with open(models_path+ 'scaler_y.pkl', 'rb') as inp:
-            scaler_y = pickle.load(inp)
-
-
+        if cache_dir is not None:
+            cache = RetrievalCache(cache_dir,max_size=cache_size)
+            key = self.retrieval_key(models_path,model_name,backend,memo_dir=cache_dir)
+            ds = cache.get(key)
+            if ds is not None:
+                for name in inference.CHASE2021_NAMES:
+                    self.ds[name] = ds[name]
+                return
+
+        #the model and scalers are only loaded from disk the first time (see drpy.core.registry)
+        bundle = get_model(models_path,model_name,backend)
+        self.run_Chase2021_blocks(bundle,memory_budget=memory_budget,batch_size=batch_size)
+
+        if cache_dir is not None:
+            ds = xr.Dataset({name:self.ds[name].variable for name in inference.CHASE2021_NAMES})
+            cache.put(key,ds.chunk({ds[inference.CHASE2021_NAMES[0]].dims[0]:256}))
+
+    def retrieval_key(self,models_path='../models/',model_name='NN_6by8.h5',backend='numpy',memo_dir=None):
+        """
+        The name the retrieval outputs of this granule are cached under. It is a hash of the contents of the file (see 
+        file_id), which scans were read and how they were cut (box, dropped scans), the contents of the model and scaler 
+        files, and the backend. 
+        """
+        name,file_id = self.file_id(memo_dir)
+        box = [getattr(self,v,None) for v in ['ll_lon','ur_lon','ll_lat','ur_lat']]
+        #in ms, so a dataset reopened from the zarr cache (which may come back in ns) gets the same key 
+        times = hashlib.sha1(np.ascontiguousarray(self.ds.time.values.astype('datetime64[ms]')).tobytes()).hexdigest() if 'time' in self.ds else None
+        options = file_id + [CACHE_VERSION,self.swath,getattr(self,'scan_ranges',None),box,times,dict(self.ds.zFactorFinal.sizes),
+                             hash_files(model_files(models_path,model_name)),backend]
+        key = hashlib.sha1(repr(options).encode()).hexdigest()
+        return name + '.' + key[:16] + '.nn'
+
+    def run_Chase2021_blocks(self,bundle,memory_budget=None,batch_size=65536):
+        """ 
+        This method runs the Chase et al. (2021) retrieval a block of scans at a time (all of them at once if 
+        memory_budget is None). One mask picks out the valid cold gates of each block, only those are pulled 
+        out and sent through the network (in batches of batch_size), then the results are put back into float32 
+        outputs made once at the start. 
 
-         
+        params::
+        bundle: dict with model, scaler_X and scaler_y (see drpy.core.registry.get_model)
+        memory_budget: float, MB of working memory to aim for 
+        batch_size: int, number of gates sent through the network at once
+        """
+        dims = list(self.ds.zFactorFinal.dims[:3])
+        shape = self.ds.zFactorFinal.shape[:3]
+        outputs = [np.full(shape,np.nan,dtype=np.float32) for name in inference.CHASE2021_NAMES]
 
-        Ku = copy.deepcopy(self.ds.zFactorFinal[:,:,:,0].values) #use the corrected Ku 
-        Ka = copy.deepcopy(self.ds.zFactorMeasured[:,:,:,1].values) #use the raw Ka
-        T = copy.deepcopy(self.ds.airTemperature.values) #grab JMA temperature 
-        T = T - 273.15 #convert to degC
+        if memory_budget is None:
+            block = max(1,shape[0])
+        else:
+            #about 100 bytes per gate of working memory (3 inputs, the mask, X and yhat, and the temporaries)
+            gates_per_scan = shape[1]*shape[2]
+            block = int(max(1,(memory_budget*2**20)//(100*gates_per_scan)))
+        for start in np.arange(0,shape[0],block):
+            s = slice(start,min(start+block,shape[0]))
+            mask,Ku,DFR,T = self.get_Chase2021_gates(s)
+            results = inference.chase2021_gates(bundle,Ku,DFR,T,batch_size=batch_size)
+            for output,result in zip(outputs,results):
+                output[s].reshape(-1)[mask] = result
+
+        for name,output in zip(inference.CHASE2021_NAMES,outputs):
+            self.ds[name] = xr.DataArray(output,dims=dims)
+
+    def get_Chase2021_gates(self,s=slice(None)):
+        """ 
+        This method picks out the gates the Chase et al. (2021) retrieval can run on: both frequencies, 
+        T <= 0 degC and DFR >= -0.5 dB (shouldnt be ever be lower than this, plus/minus Cal uncert.) 
 
-        #supress warnings. skrews up my progress bar when running in parallel
-        def warn(*args, **kwargs):
-            pass
-        import warnings
-        warnings.warn = warn
-        #
-        
-        #load the trained model 
-        tf.config.run_functions_eagerly(True)
-        model = tf.keras.models.load_model(models_path + 'NN_6by8.h5',custom_objects=None,compile=True)
-
-        #now we have to reshape things to make sure they are in the right shape for the NN model [n_samples,n_features]
-        shape_step1 = Ku.shape
-        Ku = Ku.reshape([Ku.shape[0]*Ku.shape[1]*Ku.shape[2]])
-        Ka = Ka.reshape([Ka.shape[0]*Ka.shape[1]*Ka.shape[2]])
-        T = T.reshape([T.shape[0]*T.shape[1]*T.shape[2]])
-        
-        #make sure that Ku and Ka match 
-        Ku[np.isnan(Ka)] = np.nan
-        Ka[np.isnan(Ku)] = np.nan
-        #
-        #mask gates with temperatures > 0 
-        Ku[T>0] = np.nan
-        #mask gates with DFR < -0.5, shouldnt be ever be lower than this (plus/minus Cal uncert.)
-        Ku[(Ku-Ka) < -0.5] = np.nan
-        
-        #Make sure we only run in on non-nan values to save time 
-        ind_masked = np.isnan(Ku) 
-        ind_masked2 = np.isnan(Ka)
-        Ku_nomask = np.ones(Ku.shape)*-9999.
-        Ka_nomask = np.ones(Ka.shape)*-9999.
-        T_nomask = np.ones(T.shape)*-9999.
-        Ku_nomask[~ind_masked] = Ku[~ind_masked]
-        Ka_nomask[~ind_masked] = Ka[~ind_masked]
-        T_nomask[~ind_masked] = T[~ind_masked]
-
-        ind = np.where(Ku_nomask!=-9999.)[0]
-        
-        #scale the input vectors by the mean that it was trained with
-        X = np.zeros([Ku_nomask.shape[0],3])
-        X[:,0] = (Ku_nomask - scaler_X.mean_[0])/scaler_X.scale_[0] #Ku
-        X[:,1] = ((Ku_nomask - Ka_nomask)- scaler_X.mean_[1])/scaler_X.scale_[1] #DFR Ku - Ka
-        X[:,2] = (T_nomask - scaler_X.mean_[2])/scaler_X.scale_[2] #T
-        #
-
-        #conduct the retrieval 
-        yhat = model.predict(X[ind,0:3],batch_size=len(X[ind,0]))
-        #scale it properly 
-        yhat[:,0] = (yhat[:,0]*scaler_y.scale_[0]) + scaler_y.mean_[0]
-        yhat[:,1] = (yhat[:,1]*scaler_y.scale_[1]) + scaler_y.mean_[1]
-        yhat[:,2] = (yhat[:,2]*scaler_y.scale_[2]) + scaler_y.mean_[2]
-        yhat[:,1] = 10**yhat[:,1] #unlog Dm liquid
-        yhat[:,2] = 10**yhat[:,2] #unlog Dm solid
-
-        #fill the Nw array 
-        ind = np.where(Ku_nomask!=-9999.)[0]
-        Nw = np.zeros(Ku_nomask.shape)
-        Nw[ind] = np.squeeze(yhat[:,0])
-        #reshape it back to input shape
-        Nw = Nw.reshape([shape_step1[0],shape_step1[1],shape_step1[2]])
-        Nw[Nw==0.0] = np.nan
-        #shove it into the xarray dataset 
-        self.ds['Nw_nn'] = xr.DataArray(Nw,dims=['nscan','nrayNS','nbin'])
-
-        Dm = np.zeros(Ku_nomask.shape)
-        Dm[ind] = np.squeeze(yhat[:,1])
-        Dm = Dm.reshape([shape_step1[0],shape_step1[1],shape_step1[2]])
-        Dm[Dm==0.0] = np.nan 
-        self.ds['Dml_nn'] = xr.DataArray(Dm,dims=['nscan','nrayNS','nbin'])
-        
-        Dm_frozen = np.zeros(Ku_nomask.shape)
-        Dm_frozen[ind] = np.squeeze(yhat[:,2])
-        Dm_frozen = Dm_frozen.reshape([shape_step1[0],shape_step1[1],shape_step1[2]])
-        Dm_frozen[Dm_frozen==0.0] = np.nan
-        self.ds['Dms_nn'] = xr.DataArray(Dm_frozen,dims=['nscan','nrayNS','nbin'])
-
-        #calculate IWC 
-        Nw = 10**Nw #undo log, should be in m^-4
-        Dm = Dm/1000. # convert to m ^4
-        IWC = (Nw*(Dm)**4*1000*np.pi)/4**(4) # the 1000 is density of water (kg/m^3)
-        IWC = IWC*1000 #convert to g/m^3 
-        self.ds['IWC_nn'] = xr.DataArray(IWC,dims=['nscan','nrayNS','nbin'])
-
-        #calculate R (following Chase et al. 2022 paramaterization between log(R) - log(IWC)
-        R = 3.64*(IWC**1.06)
-        self.ds['R_nn'] = xr.DataArray(R,dims=['nscan','nrayNS','nbin'])
-        
-        return
+        params::
+        s: slice, the scans to look at 
 
+        returns the mask (flat, over nscan,nray,nbin of those scans) and Ku, DFR and T of the gates in it
+        """
+        Ku = self.ds.zFactorFinal[s,:,:,0].values.reshape(-1) #use the corrected Ku 
+        DFR = Ku - self.ds.zFactorMeasured[s,:,:,1].values.reshape(-1) #use the raw Ka
+        T = self.ds.airTemperature[s].values.reshape(-1) - 273.15 #grab JMA temperature in degC
+
+        with np.errstate(invalid='ignore'):
+            mask = np.isnan(DFR)
+            mask |= DFR < -0.5
+            mask |= T > 0
+        np.logical_not(mask,out=mask)
+        return mask,Ku[mask],DFR[mask],T[mask]
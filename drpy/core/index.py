@@ -0,0 +1,182 @@
+from __future__ import absolute_import
+import glob
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .core import GPMDPR, mask_to_ranges
+
+def to_ms(t):
+    """ turn a datetime (or pandas/numpy time) into integer milliseconds since 1970 """
+    return int(np.datetime64(t,'ms').astype('int64'))
+
+class GranuleIndex():
+
+    """
+    A small sqlite file that remembers where and when each local GPM-DPR granule is, so you dont have
+    to open every file to find the ones you want.
+
+    For each granule (and each block of scans in it) it stores the lat/lon bounds, the time range and
+    whether any rain was found at the surface. Update it as new files show up with .update(), then ask
+    it which granules/scans go through a box and time window with .query(). The scans it gives back can
+    be handed straight to GPMDPR(scans=...) or GPMDPRCollection.
+    """
+
+    def __init__(self,path='drpy_index.sqlite',block_size=128):
+        """
+        Initializes things
+
+        params::
+        path: str, where to keep the sqlite index
+        block_size: int, number of scans in each block that gets its own bounds
+        """
+        self.path = path
+        self.block_size = block_size
+        self.con = sqlite3.connect(path)
+        self.con.executescript("""
+            CREATE TABLE IF NOT EXISTS granules (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, nscan INTEGER,
+                start_time INTEGER, end_time INTEGER, lat_min REAL, lat_max REAL, lon_min REAL, lon_max REAL, rain INTEGER);
+            CREATE TABLE IF NOT EXISTS blocks (path TEXT, start INTEGER, stop INTEGER,
+                start_time INTEGER, end_time INTEGER, lat_min REAL, lat_max REAL, lon_min REAL, lon_max REAL, rain INTEGER);
+            CREATE INDEX IF NOT EXISTS granules_time ON granules (start_time, end_time);
+            CREATE INDEX IF NOT EXISTS blocks_path ON blocks (path);
+            """)
+
+    def summarize(self,filename):
+        """
+        Read the geolocation, scan time and surface rain of one granule and boil it down to bounds
+        for the whole granule and for every block of scans.
+        """
+        dpr = GPMDPR(filename=filename,variables=['precipRateNearSurface'])
+        lat = dpr.ds.Latitude.values
+        lon = dpr.ds.Longitude.values
+        time = dpr.ds.time.values.astype('datetime64[ms]').astype('int64')
+        rain = np.any(dpr.ds.precipRateNearSurface.values > 0,axis=1)
+        dpr.close()
+
+        #missing geolocation is -9999.9, leave it out of the bounds
+        good = (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+        lat = np.where(good,lat,np.nan)
+        lon = np.where(good,lon,np.nan)
+        lat_min,lat_max = np.nanmin(lat,axis=1),np.nanmax(lat,axis=1)
+        lon_min,lon_max = np.nanmin(lon,axis=1),np.nanmax(lon,axis=1)
+        #scans that cross the dateline get the whole globe, its conservative but never misses anything
+        cross = (lon_max - lon_min) > 180
+        lon_min[cross] = -180
+        lon_max[cross] = 180
+
+        nscan = lat.shape[0]
+        blocks = []
+        for start in np.arange(0,nscan,self.block_size):
+            stop = min(start+self.block_size,nscan)
+            s = slice(start,stop)
+            if np.all(np.isnan(lat_min[s])):
+                continue
+            blocks.append((int(start),int(stop),int(time[s].min()),int(time[s].max()),
+                           float(np.nanmin(lat_min[s])),float(np.nanmax(lat_max[s])),
+                           float(np.nanmin(lon_min[s])),float(np.nanmax(lon_max[s])),int(np.any(rain[s]))))
+
+        if len(blocks) == 0:
+            granule = None
+        else:
+            b = np.asarray([block[2:] for block in blocks],dtype=float)
+            granule = (nscan,int(b[:,0].min()),int(b[:,1].max()),b[:,2].min(),b[:,3].max(),b[:,4].min(),b[:,5].max(),int(b[:,6].max()))
+        return granule,blocks
+
+    def update(self,filenames,n_workers=8):
+        """
+        This method adds new granules to the index (and redoes ones that changed since they were indexed).
+        Granules that are already indexed and have not changed are skipped, so this is cheap to run often.
+
+        params::
+        filenames: list of str or str, paths to GPM-DPR files, or a glob pattern
+        n_workers: int, number of granules read at the same time
+        """
+        if isinstance(filenames,str):
+            filenames = sorted(glob.glob(filenames))
+
+        known = {row[0]:(row[1],row[2]) for row in self.con.execute('SELECT path, mtime, size FROM granules')}
+        todo = []
+        for filename in filenames:
+            filename = os.path.abspath(filename)
+            stat = os.stat(filename)
+            if known.get(filename) != (stat.st_mtime,stat.st_size):
+                todo.append((filename,stat))
+
+        def work(item):
+            try:
+                return item,self.summarize(item[0])
+            except Exception as e:
+                print('Warning, could not index {}: {}'.format(item[0],e))
+                return item,None
+
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(work,todo))
+
+        with self.con:
+            for (filename,stat),summary in results:
+                if summary is None:
+                    continue
+                granule,blocks = summary
+                self.con.execute('DELETE FROM granules WHERE path = ?',(filename,))
+                self.con.execute('DELETE FROM blocks WHERE path = ?',(filename,))
+                if granule is None:
+                    continue
+                self.con.execute('INSERT INTO granules VALUES (?,?,?,?,?,?,?,?,?,?,?)',(filename,stat.st_mtime,stat.st_size)+granule)
+                self.con.executemany('INSERT INTO blocks VALUES (?,?,?,?,?,?,?,?,?,?)',[(filename,)+block for block in blocks])
+
+        return len(results)
+
+    def prune(self):
+        """ forget granules that are no longer on disk """
+        gone = [(row[0],) for row in self.con.execute('SELECT path FROM granules') if not os.path.exists(row[0])]
+        with self.con:
+            self.con.executemany('DELETE FROM granules WHERE path = ?',gone)
+            self.con.executemany('DELETE FROM blocks WHERE path = ?',gone)
+        return len(gone)
+
+    def query(self,bounding_box=None,start_time=None,end_time=None,rain=False):
+        """
+        This method finds the granules (and the scans in them) that go through a box and time window.
+
+        params::
+        bounding_box: list of floats, [lon_min,lon_max,lat_min,lat_max]
+        start_time: datetime, start of the window
+        end_time: datetime, end of the window
+        rain: bool, only return scans where rain was found at the surface
+
+        returns a dict of filename -> list of (start,stop) scan ranges
+        """
+        def conditions(table):
+            where = []
+            args = []
+            if bounding_box is not None:
+                where += [table+'.lon_max >= ?',table+'.lon_min <= ?',table+'.lat_max >= ?',table+'.lat_min <= ?']
+                args += [bounding_box[0],bounding_box[1],bounding_box[2],bounding_box[3]]
+            if start_time is not None:
+                where.append(table+'.end_time >= ?')
+                args.append(to_ms(start_time))
+            if end_time is not None:
+                where.append(table+'.start_time <= ?')
+                args.append(to_ms(end_time))
+            if rain:
+                where.append(table+'.rain = 1')
+            return ' AND '.join(where) if len(where) > 0 else '1',args
+
+        #the granule table is small, narrow things down there first then look at the blocks
+        g_where,g_args = conditions('g')
+        b_where,b_args = conditions('b')
+        sql = ('SELECT b.path, b.start, b.stop, g.nscan FROM granules g JOIN blocks b ON b.path = g.path '
+               'WHERE ' + g_where + ' AND ' + b_where + ' ORDER BY b.path, b.start')
+        hits = {}
+        for path,start,stop,nscan in self.con.execute(sql,g_args+b_args):
+            if path not in hits:
+                hits[path] = np.zeros(nscan,dtype=bool)
+            hits[path][start:stop] = True
+
+        #join neighboring blocks into one range
+        return {path:mask_to_ranges(mask) for path,mask in hits.items()}
+
+    def close(self):
+        """ close the sqlite connection """
+        self.con.close()
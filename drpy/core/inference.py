@@ -0,0 +1,246 @@
+"""
+Run the Chase et al. (2021) neural network with plain numpy (no tensorflow).
+
+The network is a small stack of Dense and BatchNormalization layers. The weights are read straight out of the
+keras .h5 file with h5py (or out of a compact .npz made with export_npz), the BatchNormalization layers are folded
+into the Dense layer after them and the forward pass is just a few matrix multiplies.
+"""
+from __future__ import absolute_import
+import json
+import os
+import numpy as np
+import h5py
+from .registry import dummy_class, load_scaler
+
+#the layers this engine knows how to run
+SUPPORTED_LAYERS = ['Dense','BatchNormalization']
+#the variables the Chase et al. (2021) retrieval makes, in the order chase2021_gates gives them back
+CHASE2021_NAMES = ['Nw_nn','Dml_nn','Dms_nn','IWC_nn','R_nn']
+ACTIVATIONS = {'linear':lambda x: x,
+               'relu':lambda x: np.maximum(x,0,out=x)}
+
+def read_keras_h5(filename):
+    """
+    Read the layers of a keras Sequential model saved as .h5 (tf.keras 2.x).
+
+    returns a list of dicts, one per layer, with the layer type (kind), its settings and its weights
+    """
+    layers = []
+    with h5py.File(filename,'r') as f:
+        config = f.attrs['model_config']
+        if isinstance(config,bytes):
+            config = config.decode('utf-8')
+        config = json.loads(config)
+        group = f['model_weights']
+        for layer in config['config']['layers']:
+            kind = layer['class_name']
+            c = layer['config']
+            if kind == 'InputLayer':
+                continue
+            if kind not in SUPPORTED_LAYERS:
+                raise ValueError('Layer {} ({}) is not supported, only {}'.format(c['name'],kind,SUPPORTED_LAYERS))
+            #weights are stored at model_weights/<name>/<name>/<weight>:0
+            weights = {}
+            def visit(name,obj):
+                if isinstance(obj,h5py.Dataset):
+                    weights[name.split('/')[-1].split(':')[0]] = obj[...]
+            group[c['name']].visititems(visit)
+            if kind == 'Dense':
+                layers.append({'kind':kind,'name':c['name'],'activation':c.get('activation','linear'),
+                               'kernel':weights['kernel'],'bias':weights.get('bias',np.zeros(weights['kernel'].shape[1],dtype=weights['kernel'].dtype))})
+            else:
+                n = weights['moving_mean'].shape[0]
+                layers.append({'kind':kind,'name':c['name'],'epsilon':c.get('epsilon',0.001),
+                               'gamma':weights.get('gamma',np.ones(n,dtype=np.float32)),
+                               'beta':weights.get('beta',np.zeros(n,dtype=np.float32)),
+                               'moving_mean':weights['moving_mean'],'moving_variance':weights['moving_variance']})
+    return layers
+
+class NumpyModel():
+
+    """
+    A forward pass of a Dense/BatchNormalization network in numpy. It has a predict method that works like the
+    keras one, so it can be swapped in for the tensorflow model.
+    """
+
+    def __init__(self,layers,dtype=np.float32):
+        """
+        params::
+        layers: list of dicts, from read_keras_h5 (or read back out of an .npz)
+        dtype: numpy dtype to do the math in. float32 is what keras uses
+        """
+        self.layers = layers
+        self.dtype = np.dtype(dtype)
+        self.fold()
+
+    def fold(self):
+        """
+        Turn the layers into a list of (kernel,bias,activation). At inference time a BatchNormalization layer is
+        just x*a + b, so it gets folded into the Dense layer that comes next (or into its own identity step
+        if it is the last layer)
+        """
+        steps = []
+        a = None
+        b = None
+        for layer in self.layers:
+            if layer['kind'] == 'BatchNormalization':
+                scale = layer['gamma'].astype(np.float64)/np.sqrt(layer['moving_variance'].astype(np.float64) + layer['epsilon'])
+                shift = layer['beta'].astype(np.float64) - layer['moving_mean'].astype(np.float64)*scale
+                if a is None:
+                    a,b = scale,shift
+                else:
+                    a,b = a*scale,b*scale + shift
+            else:
+                kernel = layer['kernel'].astype(np.float64)
+                bias = layer['bias'].astype(np.float64)
+                if a is not None:
+                    bias = b.dot(kernel) + bias
+                    kernel = a[:,np.newaxis]*kernel
+                    a = b = None
+                steps.append([kernel,bias,layer['activation']])
+        if a is not None:
+            steps.append([np.diag(a),b,'linear'])
+        self.steps = [(k.astype(self.dtype),bb.astype(self.dtype),ACTIVATIONS[act]) for k,bb,act in steps]
+
+    def predict(self,X,batch_size=None,**kwargs):
+        """
+        Run the network on X [n_samples,n_features]. batch_size splits X into pieces to keep memory down
+        (None does it all at once). Returns [n_samples,n_outputs]
+        """
+        X = np.asarray(X)
+        n = X.shape[0]
+        if (batch_size is None) or (batch_size <= 0) or (batch_size >= n):
+            return self.forward(X)
+        out = np.empty((n,self.steps[-1][0].shape[1]),dtype=self.dtype)
+        for start in range(0,n,batch_size):
+            out[start:start+batch_size] = self.forward(X[start:start+batch_size])
+        return out
+
+    def forward(self,X):
+        """ one forward pass through the whole network """
+        x = X.astype(self.dtype,copy=False)
+        for kernel,bias,activation in self.steps:
+            x = x.dot(kernel)
+            x += bias
+            x = activation(x)
+        return x
+
+def make_scaler(mean,scale):
+    """ make a scaler like the pickled ones (has mean_ and scale_) """
+    scaler = dummy_class()
+    scaler.mean_ = [np.float64(m) for m in mean]
+    scaler.scale_ = [np.float64(s) for s in scale]
+    return scaler
+
+def export_npz(models_path='../models/',model_name='NN_6by8.h5',filename=None):
+    """
+    Write the weights of a keras .h5 model and its scalers into one small .npz. No tensorflow needed, to read or
+    write it. Load it back with load_npz, or with GPMDPR.run_Chase2021(model_name='NN_6by8.npz').
+
+    params::
+    models_path: str, folder with the model and scaler_X.pkl/scaler_y.pkl
+    model_name: str, name of the keras model
+    filename: str, where to save it. Defaults to the model name with .npz on the end, in models_path
+
+    returns the filename written
+    """
+    if filename is None:
+        filename = os.path.join(models_path,os.path.splitext(model_name)[0] + '.npz')
+    layers = read_keras_h5(os.path.join(models_path,model_name))
+    scaler_X = load_scaler(os.path.join(models_path,'scaler_X.pkl'))
+    scaler_y = load_scaler(os.path.join(models_path,'scaler_y.pkl'))
+
+    arrays = {}
+    config = []
+    for i,layer in enumerate(layers):
+        c = {}
+        for key,value in layer.items():
+            if isinstance(value,np.ndarray):
+                arrays['{}_{}'.format(i,key)] = value
+            else:
+                c[key] = value
+        config.append(c)
+    arrays['config'] = np.array(json.dumps(config))
+    arrays['scaler_X_mean'] = np.asarray(scaler_X.mean_,dtype=np.float64)
+    arrays['scaler_X_scale'] = np.asarray(scaler_X.scale_,dtype=np.float64)
+    arrays['scaler_y_mean'] = np.asarray(scaler_y.mean_,dtype=np.float64)
+    arrays['scaler_y_scale'] = np.asarray(scaler_y.scale_,dtype=np.float64)
+    np.savez_compressed(filename,**arrays)
+    return filename
+
+def load_npz(filename):
+    """ load an .npz made by export_npz, returns a dict with model, scaler_X and scaler_y """
+    with np.load(filename,allow_pickle=False) as f:
+        config = json.loads(str(f['config']))
+        layers = []
+        for i,c in enumerate(config):
+            layer = dict(c)
+            prefix = '{}_'.format(i)
+            for key in f.files:
+                if key.startswith(prefix):
+                    layer[key[len(prefix):]] = f[key]
+            layers.append(layer)
+        return {'model':NumpyModel(layers),
+                'scaler_X':make_scaler(f['scaler_X_mean'],f['scaler_X_scale']),
+                'scaler_y':make_scaler(f['scaler_y_mean'],f['scaler_y_scale'])}
+
+def load_numpy_bundle(models_path,model_name='NN_6by8.h5'):
+    """ load a model (.h5 or .npz) and its scalers to run with numpy """
+    filename = os.path.join(models_path,model_name)
+    if filename.endswith('.npz'):
+        return load_npz(filename)
+    return {'model':NumpyModel(read_keras_h5(filename)),
+            'scaler_X':load_scaler(os.path.join(models_path,'scaler_X.pkl')),
+            'scaler_y':load_scaler(os.path.join(models_path,'scaler_y.pkl'))}
+
+def chase2021_gates(bundle,Ku,DFR,T,batch_size=65536):
+    """
+    Run the Chase et al. (2021) retrieval on a 1d list of gates that have already been picked out
+    (valid Ku and Ka, T <= 0 degC and DFR >= -0.5 dB). Everything after the inputs is done in place
+    on one [n_gates,3] float32 array, so memory only goes with the number of gates.
+
+    params::
+    bundle: dict with model, scaler_X and scaler_y (see drpy.core.registry.get_model)
+    Ku: 1d array, corrected Ku-band reflectivity [dBZ]
+    DFR: 1d array, Ku - Ka dual-frequency ratio [dB]
+    T: 1d array, temperature [degC]
+    batch_size: int, number of gates sent through the network at once
+
+    returns Nw [log(m^-4)], Dml [mm], Dms [mm], IWC [g m^-3] and R [mm hr^-1], 1d arrays the size of Ku
+    """
+    scaler_X = bundle['scaler_X']
+    scaler_y = bundle['scaler_y']
+
+    #scale the input vectors by the mean that it was trained with
+    X = np.empty([Ku.shape[0],3],dtype=np.float32)
+    X[:,0] = Ku
+    X[:,1] = DFR
+    X[:,2] = T
+    X -= np.asarray(scaler_X.mean_,dtype=np.float32)
+    X /= np.asarray(scaler_X.scale_,dtype=np.float32)
+
+    #conduct the retrieval 
+    if X.shape[0] == 0:
+        yhat = X
+    else:
+        yhat = np.asarray(bundle['model'].predict(X,batch_size=batch_size),dtype=np.float32)
+    del X
+
+    #scale it properly, then unlog Dm liquid and Dm solid
+    yhat *= np.asarray(scaler_y.scale_,dtype=np.float32)
+    yhat += np.asarray(scaler_y.mean_,dtype=np.float32)
+    np.power(np.float32(10),yhat[:,1:],out=yhat[:,1:])
+    Nw = yhat[:,0]
+    Dml = yhat[:,1]
+    Dms = yhat[:,2]
+    #zeros are used as missing
+    Nw[Nw == 0.0] = np.nan
+
+    #calculate IWC = Nw Dm^4 rho_w pi / 4^4, with Nw in m^-4, Dm in m and the density of water 1000 kg m^-3, then to g m^-3 
+    IWC = np.power(np.float32(10),Nw)
+    IWC *= Dml**4
+    IWC *= np.float32(1000*np.pi/4**4*1000/1000.**4)
+    #calculate R (following Chase et al. 2022 paramaterization between log(R) - log(IWC)
+    R = np.power(IWC,np.float32(1.06))
+    R *= np.float32(3.64)
+    return Nw,Dml,Dms,IWC,R
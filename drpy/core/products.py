@@ -0,0 +1,217 @@
+"""
+Layouts of the GPM-DPR level 2 products DRpy can read. For each product, version and swath this has
+the groups to open, the dimension names (and lengths, when they are fixed) of each group and of each
+variable, and which group each variable lives in. With this the reader can name every dimension without
+opening each group with netCDF first to see what is in it.
+
+Dimensions are listed in the order they show up in the file (the order netCDF numbers its phony dims).
+A length of None means it changes from file to file (nscan) or is not pinned down here.
+"""
+from __future__ import absolute_import
+import functools
+import os
+import re
+
+#groups (below the swath, e.g., /FS/) that are read with the heavy flag off or on. '' is the swath group itself
+LIGHT_GROUPS = ['','PRE','SLV','ScanTime']
+HEAVY_GROUPS = {'V07':['','PRE','SLV','VER','SRT','CSF','Experimental','FLG','ScanTime'],
+                'V06':['','PRE','SLV','VER','SRT','CSF','DSD','Experimental','FLG','ScanTime']}
+
+#axes of each variable, in the order they are in the file. 'scan', 'ray' and 'bin' become the swath's nscan, ray and
+#range bin dims, 'freq' is nfreq (and is left out on single frequency swaths), anything else is a dim of that name 
+#(with the length in FIXED_DIMS, if it has one)
+S = ('scan',)
+SR = ('scan','ray')
+SRF = ('scan','ray','freq')
+SRB = ('scan','ray','bin')
+SRBF = ('scan','ray','bin','freq')
+SCANTIME = {name:S for name in ['Year','Month','DayOfMonth','Hour','Minute','Second','MilliSecond','DayOfYear','SecondOfDay']}
+
+V07_VARIABLES = {'':{'Latitude':SR,'Longitude':SR},
+                 'ScanTime':SCANTIME,
+                 'PRE':{'elevation':SR,'landSurfaceType':SR,'localZenithAngle':SR,'flagPrecip':SR,'binRealSurface':SRF,
+                        'binStormTop':SRF,'heightStormTop':SRF,'binClutterFreeBottom':SRF,'sigmaZeroMeasured':SRF,
+                        'zFactorMeasured':SRBF,'ellipsoidBinOffset':SRF,'snRatioAtRealSurface':SRF,'adjustFactor':SRF,
+                        'snowIceCover':SR,'height':SRB,'flagSigmaZeroSaturation':SRF},
+                 'VER':{'binZeroDeg':SR,'binZeroDegSecondary':SR,'heightZeroDeg':SR,'attenuationNP':SRBF,
+                        'piaNP':SR+('nNP','freq'),'sigmaZeroNPCorrected':SRF,'airTemperature':SRB},
+                 'CSF':{'flagBB':SR,'binBBPeak':SR,'binBBTop':SR,'binBBBottom':SR,'heightBB':SR,'widthBB':SR,'qualityBB':SR,
+                        'typePrecip':SR,'qualityTypePrecip':SR,'flagShallowRain':SR,'flagHeavyIcePrecip':SR+('nfreqHI',),
+                        'flagAnvil':SR,'binDFRmMLBottom':SR,'binDFRmMLTop':SR,'flagGraupelHail':SR,
+                        'binHeavyIcePrecipTop':SR+('nfreqHI',),'binHeavyIcePrecipBottom':SR+('nfreqHI',),
+                        'nHeavyIcePrecip':SR+('nfreqHI',)},
+                 'SRT':{'PIAalt':SR+('method','freq'),'RFactorAlt':SRF,'PIAweight':SR+('method','freq'),'pathAtten':SR,
+                        'reliabFactor':SR,'reliabFlag':SR,'refScanID':SR+('foreBack','nearFar'),'PIAhb':SRF,'PIAhybrid':SRF,
+                        'reliabFactorHY':SR,'reliabFlagHY':SR,'stddevEff':SR+('nsdew',),'stddevHY':SRF},
+                 'Experimental':{'precipRateESurface2':SR,'precipRateESurface2Status':SR,
+                                 'sigmaZeroProfile':SR+('nbinSZP','freq'),'binDEML2':SR+('nbinSZP',),
+                                 'seaIceConcentration':SR,'flagSurfaceSnowfall':SR,'surfaceSnowfallIndex':SR},
+                 'SLV':{'flagSLV':SRB,'binEchoBottom':SR,'piaFinal':SRF,'sigmaZeroCorrected':SRF,'zFactorFinal':SRBF,
+                        'zFactorFinalESurface':SRF,'zFactorFinalNearSurface':SRF,'paramDSD':SRBF,'precipRate':SRB,
+                        'precipWaterIntegrated':SRF,'qualitySLV':SR,'precipRateNearSurface':SR,'precipRateESurface':SR,
+                        'precipRateAve24':SR,'phaseNearSurface':SR,'binMixedPhaseTop':SR,'paramNUBF':SR+('nNUBF',),
+                        'epsilon':SRB},
+                 'FLG':{'flagEcho':SRBF,'qualityData':SR,'qualityFlag':SR,'flagSensor':S}}
+
+#V06 has the DSD group, calls the attenuation corrected reflectivity zFactorCorrected and has no V07-only extras
+V06_VARIABLES = {'':V07_VARIABLES[''],
+                 'ScanTime':SCANTIME,
+                 'PRE':{name:axes for name,axes in V07_VARIABLES['PRE'].items() if name not in ['snowIceCover','flagSigmaZeroSaturation']},
+                 'VER':{name:axes for name,axes in V07_VARIABLES['VER'].items() if name != 'binZeroDegSecondary'},
+                 'CSF':{'flagBB':SR,'binBBPeak':SR,'binBBTop':SR,'binBBBottom':SR,'heightBB':SR,'widthBB':SR,'qualityBB':SR,
+                        'typePrecip':SR,'qualityTypePrecip':SR,'flagShallowRain':SR,'flagHeavyIcePrecip':SR,'flagAnvil':SR},
+                 'SRT':{name:axes for name,axes in V07_VARIABLES['SRT'].items()},
+                 'DSD':{'phase':SRB,'binNode':SR+('nNode',)},
+                 'Experimental':{'precipRateESurface2':SR,'precipRateESurface2Status':SR,'sigmaZeroProfile':SR+('nbinSZP','freq'),
+                                 'binDEML2':SR+('nbinSZP',)},
+                 'SLV':{'flagSLV':SRB,'binEchoBottom':SR,'piaFinal':SRF,'sigmaZeroCorrected':SRF,'zFactorCorrected':SRBF,
+                        'zFactorCorrectedESurface':SRF,'zFactorCorrectedNearSurface':SRF,'paramDSD':SRBF,'precipRate':SRB,
+                        'precipWaterIntegrated':SRF,'qualitySLV':SR,'precipRateNearSurface':SR,'precipRateESurface':SR,
+                        'precipRateAve24':SR,'phaseNearSurface':SR,'epsilon':SRB},
+                 'FLG':{'flagEcho':SRBF,'qualityData':SR,'qualityFlag':SR}}
+
+#version -> group -> variable -> axes
+VARIABLES = {'V07':V07_VARIABLES,'V06':V06_VARIABLES}
+
+#lengths of the dims that are always the same 
+FIXED_DIMS = {'nfreq':2,'nNP':4,'foreBack':2,'nearFar':2,'nbinSZP':7,'nfreqHI':3,'nNode':5}
+
+#variables in each group and which group each variable lives in, for each version. Used to only open the groups you need.
+VERSION_GROUP_VARIABLES = {version:{group:list(names) for group,names in groups.items()} for version,groups in VARIABLES.items()}
+VERSION_VARIABLE_GROUPS = {version:{name:group for group,names in groups.items() for name in names}
+                           for version,groups in VARIABLES.items()}
+#the V07 ones (the default product)
+GROUP_VARIABLES = VERSION_GROUP_VARIABLES['V07']
+VARIABLE_GROUPS = VERSION_VARIABLE_GROUPS['V07']
+
+#variables that are always loaded, even if you only ask for a few
+ALWAYS_KEEP = ['Latitude','Longitude','Year','Month','DayOfMonth','Hour','Minute','Second','MilliSecond',
+               'DayOfYear','SecondOfDay']
+
+def make_group_dims(ray,nray,nbin_name,nbin,dual):
+    """
+    Dimension names/lengths of every group in one swath.
+
+    params::
+    ray: str, name of the ray dim (e.g., 'nrayNS')
+    nray: int, number of rays (49 for the full swath, 25 for V6 MS, 24 for HS)
+    nbin_name: str, name of the range bin dim
+    nbin: int, number of range bins (176, or 88 for HS)
+    dual: bool, True if the swath has both frequencies (i.e., has an nfreq dim)
+    """
+    scan = [('nscan',None),(ray,nray)]
+    freq = [('nfreq',2)] if dual else []
+    rbin = [(nbin_name,nbin)]
+    return {'':scan,
+            'PRE':scan+freq+rbin,
+            'SLV':scan+rbin+freq+[('nNUBF',None)],
+            'VER':scan+rbin+freq+[('nNP',4)],
+            'SRT':scan+[('method',None),('foreBack',2),('nearFar',2),('nsdew',None)],
+            'CSF':scan+[('nfreqHI',3)],
+            'DSD':scan+rbin+[('nNode',5)],
+            'Experimental':scan+[('nbinSZP',7)]+freq,
+            'FLG':scan+rbin+freq,
+            'ScanTime':[('nscan',None)]}
+
+def make_variable_dims(version,ray,nray,nbin_name,nbin,dual):
+    """
+    Dimension names/lengths of every variable in one swath (same params as make_group_dims, plus the version).
+
+    returns a dict of group -> variable -> tuple of (name,length)
+    """
+    axes = {'scan':('nscan',None),'ray':(ray,nray),'bin':(nbin_name,nbin),'freq':('nfreq',2)}
+    dims = {}
+    for group,variables in VARIABLES[version].items():
+        dims[group] = {}
+        for name,names in variables.items():
+            dims[group][name] = tuple([axes[a] if a in axes else (a,FIXED_DIMS.get(a)) for a in names if dual or (a != 'freq')])
+    return dims
+
+#(product,version) -> swath -> (ray dim, number of rays, range bin dim, number of bins, dual frequency). 
+#The first swath listed is the default
+PRODUCTS = {('2A.DPR','V07'):{'FS':('nrayNS',49,'nbin',176,True),
+                              'HS':('nrayHS',24,'nbinHS',88,False)},
+            ('2A.Ku','V07'):{'FS':('nrayNS',49,'nbin',176,False)},
+            ('2A.Ka','V07'):{'FS':('nrayNS',49,'nbin',176,False),
+                             'HS':('nrayHS',24,'nbinHS',88,False)},
+            ('2A.DPR','V06'):{'NS':('nrayNS',49,'nbin',176,False),
+                              'MS':('nrayMS',25,'nbin',176,True),
+                              'HS':('nrayHS',24,'nbinHS',88,False)},
+            ('2A.Ku','V06'):{'NS':('nrayNS',49,'nbin',176,False)},
+            ('2A.Ka','V06'):{'MS':('nrayMS',25,'nbin',176,False),
+                             'HS':('nrayHS',24,'nbinHS',88,False)}}
+
+@functools.lru_cache(maxsize=None)
+def get_layout(product='2A.DPR',version='V07',swath=None):
+    """
+    Look up the layout of one swath of a product.
+
+    returns a dict with the swath name, the group dims, the dims of each variable (variable_dims, group -> variable ->
+    tuple of (name,length)), the light/heavy groups and the variable->group map of that version
+    """
+    if (product,version) not in PRODUCTS:
+        raise ValueError('Unknown product {} {}. Known products are {}'.format(product,version,list(PRODUCTS.keys())))
+    swaths = PRODUCTS[(product,version)]
+    if swath is None:
+        swath = list(swaths.keys())[0]
+    if swath not in swaths:
+        raise ValueError('{} {} has no {} swath, pick one of {}'.format(product,version,swath,list(swaths.keys())))
+    return {'swath':swath,'dims':make_group_dims(*swaths[swath]),'variable_dims':make_variable_dims(version,*swaths[swath]),
+            'light':LIGHT_GROUPS,'heavy':HEAVY_GROUPS[version],'variables':VERSION_VARIABLE_GROUPS[version],
+            'always':ALWAYS_KEEP}
+
+def get_product(h5,filename=None):
+    """
+    Figure out the product (e.g., '2A.DPR') and version (e.g., 'V07') of an open hdf5 file. The FileHeader
+    attribute is checked first, then the file name. Falls back to V7 2A.DPR.
+    """
+    header = h5.attrs.get('FileHeader',b'')
+    if isinstance(header,bytes):
+        header = header.decode('utf-8','replace')
+    algorithm = re.search(r'AlgorithmID=2A(DPR|Ku|Ka)',str(header))
+    version = re.search(r'AlgorithmVersion=V?0?(\d)',str(header))
+    if (algorithm is not None) and (version is not None):
+        return '2A.'+algorithm.group(1),'V0'+version.group(1)
+
+    #e.g., 2A.GPM.DPR.V9-20211125.20210601-S120000-E133000.041234.V07A.HDF5
+    if isinstance(filename,str):
+        match = re.search(r'2A\.GPM\.(DPR|Ku|Ka)\..*\.V0?(\d)[A-Z]\.HDF5',os.path.basename(filename))
+        if match is not None:
+            return '2A.'+match.group(1),'V0'+match.group(2)
+    return '2A.DPR','V07'
+
+def name_dims(lengths,schema):
+    """
+    Give proper names to the phony dims found in a group.
+
+    params::
+    lengths: list of int, length of each phony dim, in the order they show up
+    schema: list of (name,length) from the layout
+
+    If the number of dims and every known length line up, names go on in order (like netCDF's phony dims).
+    Otherwise each dim gets the first unused name with the same length, then the names with unknown length
+    in order, and anything left over keeps a phony_dim_N name. nscan is always the first dim.
+    """
+    if (len(lengths) == len(schema)) and all([(l is None) or (l == n) for n,(name,l) in zip(lengths,schema)]):
+        return [name for name,l in schema]
+
+    names = [None]*len(lengths)
+    unused = list(range(len(schema)))
+    if (len(lengths) > 0) and (len(schema) > 0):
+        names[0] = schema[0][0]
+        unused.remove(0)
+    for i,n in enumerate(lengths):
+        if names[i] is None:
+            match = [j for j in unused if schema[j][1] == n]
+            if len(match) > 0:
+                names[i] = schema[match[0]][0]
+                unused.remove(match[0])
+    for i in range(len(lengths)):
+        if names[i] is None:
+            match = [j for j in unused if schema[j][1] is None]
+            if len(match) > 0:
+                names[i] = schema[match[0]][0]
+                unused.remove(match[0])
+            else:
+                names[i] = 'phony_dim_'+str(i)
+    return names
@@ -0,0 +1,120 @@
+"""
+A process-wide cache of the neural network models (and their scalers) used by GPMDPR.run_Chase2021.
+
+Loading a model means unpickling two scalers, importing tensorflow and reading the .h5 file, which can take
+longer than running the retrieval. Here each model bundle is loaded once per process and kept around, keyed by
+where it lives on disk. If more than maxsize bundles get loaded, the one used longest ago is dropped.
+"""
+from __future__ import absolute_import
+import collections
+import os
+import pickle
+import threading
+
+class dummy_class():
+    """ stand in for the class the scalers were pickled with. Just holds mean_ and scale_ """
+    pass
+
+class ScalerUnpickler(pickle.Unpickler):
+    """ The scalers were pickled from a script, so they point at __main__.dummy_class. Send that here instead """
+    def find_class(self,module,name):
+        if name == 'dummy_class':
+            return dummy_class
+        return pickle.Unpickler.find_class(self,module,name)
+
+def load_scaler(filename):
+    """ load one of the pickled scalers (has mean_ and scale_) """
+    with open(filename,'rb') as inp:
+        return ScalerUnpickler(inp).load()
+
+def load_keras(filename):
+    """ load a keras model with tensorflow """
+    try:
+        import tensorflow as tf
+    except ImportError:
+        raise ImportError("No Tensorflow. Please go install it with conda")
+    tf.config.run_functions_eagerly(True)
+    return tf.keras.models.load_model(filename,custom_objects=None,compile=True)
+
+def load_bundle(models_path,model_name='NN_6by8.h5',backend='keras'):
+    """
+    load a model and its scalers from disk, returns a dict with model, scaler_X and scaler_y
+
+    backend: str, 'keras' (tensorflow) or 'numpy' (see drpy.core.inference, no tensorflow needed)
+    """
+    if backend == 'numpy':
+        from .inference import load_numpy_bundle
+        return load_numpy_bundle(models_path,model_name)
+    if backend != 'keras':
+        raise ValueError("Unknown backend {}, pick 'keras' or 'numpy'".format(backend))
+    return {'model':load_keras(os.path.join(models_path,model_name)),
+            'scaler_X':load_scaler(os.path.join(models_path,'scaler_X.pkl')),
+            'scaler_y':load_scaler(os.path.join(models_path,'scaler_y.pkl'))}
+
+class ModelRegistry():
+
+    """
+    Keeps loaded model bundles around so they only get loaded once. Safe to use from many threads, the
+    same bundle is never loaded twice at the same time.
+    """
+
+    def __init__(self,maxsize=4,loader=load_bundle):
+        """
+        params::
+        maxsize: int, number of bundles to keep loaded
+        loader: function(models_path,model_name,backend) that loads a bundle
+        """
+        self.maxsize = maxsize
+        self.loader = loader
+        self.bundles = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.key_locks = {}
+
+    def key(self,models_path,model_name,backend='keras'):
+        """ bundles are keyed by the full path and modification time of the model (so a new model file gets reloaded) and the backend """
+        filename = os.path.abspath(os.path.join(models_path,model_name))
+        try:
+            mtime = os.path.getmtime(filename)
+        except OSError:
+            mtime = None
+        return (filename,mtime,backend)
+
+    def get(self,models_path,model_name='NN_6by8.h5',backend='keras'):
+        """ get a bundle, loading it if it is not here yet """
+        key = self.key(models_path,model_name,backend)
+        with self.lock:
+            if key in self.bundles:
+                self.bundles.move_to_end(key)
+                return self.bundles[key]
+            key_lock = self.key_locks.setdefault(key,threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                if key in self.bundles:
+                    self.bundles.move_to_end(key)
+                    return self.bundles[key]
+            bundle = self.loader(models_path,model_name,backend)
+            with self.lock:
+                self.bundles[key] = bundle
+                while len(self.bundles) > self.maxsize:
+                    self.bundles.popitem(last=False)
+                self.key_locks.pop(key,None)
+        return bundle
+
+    def clear(self):
+        """ drop all loaded bundles """
+        with self.lock:
+            self.bundles.clear()
+
+    def __len__(self):
+        return len(self.bundles)
+
+    def __contains__(self,key):
+        return key in self.bundles
+
+#the one registry everything in this process uses
+MODELS = ModelRegistry()
+
+def get_model(models_path='../models/',model_name='NN_6by8.h5',backend='keras'):
+    """ get a model bundle (dict with model, scaler_X and scaler_y) from the process-wide registry """
+    return MODELS.get(models_path,model_name,backend)
@@ -0,0 +1,155 @@
+from __future__ import absolute_import
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+import xarray as xr
+from .core import GPMDPR
+from .registry import get_model
+from . import inference
+
+#the variables the Chase et al. (2021) retrieval needs
+CHASE2021_INPUTS = ['zFactorFinal','zFactorMeasured','airTemperature']
+
+def read_gates(filename,scans=None):
+    """
+    Open one granule and pick out the gates the Chase et al. (2021) retrieval runs on. This is what the worker
+    processes do, so only the (small) list of valid gates has to be sent back.
+
+    returns a dict with the filename, dims, shape, packed mask and the Ku, DFR and T of the valid gates
+    """
+    dpr = GPMDPR(filename=filename,variables=CHASE2021_INPUTS,scans=scans)
+    try:
+        dims = list(dpr.ds.zFactorFinal.dims[:3])
+        shape = dpr.ds.zFactorFinal.shape[:3]
+        mask,Ku,DFR,T = dpr.get_Chase2021_gates()
+    finally:
+        dpr.close()
+    return {'filename':filename,'dims':dims,'shape':shape,'mask':np.packbits(mask),
+            'Ku':Ku.astype(np.float32),'DFR':DFR.astype(np.float32),'T':T.astype(np.float32)}
+
+class ChaseRetrieval():
+
+    """
+    This class runs the Chase et al. (2021) retrieval over lots of granules.
+
+    Granules are opened (and the valid gates picked out) in a pool of processes, so the reading and masking
+    uses all the cores. The gates from several granules get pooled into big batches that go through one
+    model in this process, then the *_nn variables are put back together for each granule. They are either
+    written next to each other in output_dir (one netCDF per granule) or kept in .results.
+    """
+
+    def __init__(self,filenames=[],models_path='../models/',model_name='NN_6by8.h5',backend='numpy',output_dir=None,
+                 n_workers=None,batch_size=2**21,auto_run=True,verbose=False):
+        """
+        Initializes things
+
+        params::
+        filenames: list of str or str, paths to GPM-DPR files, or a glob pattern. Can also be a dict of
+        filename -> list of (start,stop) scan ranges (e.g., from GranuleIndex.query)
+        models_path: str, folder with the model and scalers
+        model_name: str, the model (see GPMDPR.run_Chase2021)
+        backend: str, 'numpy' or 'keras' (see GPMDPR.run_Chase2021)
+        output_dir: str, folder to write <granule>.nn.nc files to. If None the outputs are kept in .results
+        n_workers: int, number of processes reading granules. Defaults to the number of cores
+        batch_size: int, gates are pooled until there are at least this many, then run all at once
+        verbose: bool, print how it went (granules, gates, gates/s) at the end
+        """
+        if isinstance(filenames,str):
+            filenames = sorted(glob.glob(filenames))
+        self.scans = {}
+        if isinstance(filenames,dict):
+            self.scans = filenames
+        self.filenames = list(filenames)
+        self.models_path = models_path
+        self.model_name = model_name
+        self.backend = backend
+        self.output_dir = output_dir
+        self.n_workers = n_workers or os.cpu_count()
+        self.batch_size = batch_size
+        self.verbose = verbose
+        self.results = {}
+        self.stats = {}
+
+        if auto_run:
+            self.run()
+
+    def run(self):
+        """
+        This method reads all the granules in the process pool and runs the retrieval as their gates come in.
+        Only about 2*n_workers granules are in flight at a time so memory stays flat no matter how many files.
+        """
+        bundle = get_model(self.models_path,self.model_name,self.backend)
+        if self.output_dir is not None:
+            os.makedirs(self.output_dir,exist_ok=True)
+
+        t0 = time.perf_counter()
+        self.stats = {'granules':0,'failed':0,'gates':0,'batches':0,'inference_seconds':0.}
+        pending = []
+        todo = list(self.filenames)
+        running = set()
+        with ProcessPoolExecutor(max_workers=self.n_workers) as pool:
+            while (len(todo) > 0) or (len(running) > 0):
+                while (len(todo) > 0) and (len(running) < 2*self.n_workers):
+                    filename = todo.pop(0)
+                    future = pool.submit(read_gates,filename,self.scans.get(filename))
+                    future.filename = filename
+                    running.add(future)
+                done,running = wait(running,return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        pending.append(future.result())
+                    except Exception as e:
+                        print('Warning, could not read {}: {}'.format(future.filename,e))
+                        self.stats['failed'] += 1
+                if sum([granule['Ku'].shape[0] for granule in pending]) >= self.batch_size:
+                    self.flush(bundle,pending)
+                    pending = []
+            self.flush(bundle,pending)
+
+        seconds = time.perf_counter() - t0
+        self.stats['seconds'] = seconds
+        self.stats['gates_per_second'] = self.stats['gates']/seconds if seconds > 0 else np.nan
+        if self.verbose:
+            print('Ran {granules} granules, {gates} gates in {seconds:.1f} s ({gates_per_second:.3g} gates/s)'.format(**self.stats))
+
+    def flush(self,bundle,pending):
+        """ run the pooled gates of some granules through the model in one go and split the results back up """
+        if len(pending) == 0:
+            return
+        t = time.perf_counter()
+        Ku = np.concatenate([granule['Ku'] for granule in pending])
+        DFR = np.concatenate([granule['DFR'] for granule in pending])
+        T = np.concatenate([granule['T'] for granule in pending])
+        results = inference.chase2021_gates(bundle,Ku,DFR,T,batch_size=self.batch_size)
+        self.stats['inference_seconds'] += time.perf_counter() - t
+        self.stats['batches'] += 1
+
+        start = 0
+        for granule in pending:
+            stop = start + granule['Ku'].shape[0]
+            self.finish(granule,[result[start:stop] for result in results])
+            start = stop
+
+    def finish(self,granule,results):
+        """ put the results of one granule back on its grid and write/keep them """
+        shape = granule['shape']
+        mask = np.unpackbits(granule['mask'],count=int(np.prod(shape))).astype(bool)
+        ds = xr.Dataset()
+        for name,result in zip(inference.CHASE2021_NAMES,results):
+            output = np.full(shape,np.nan,dtype=np.float32)
+            output.reshape(-1)[mask] = result
+            ds[name] = xr.DataArray(output,dims=granule['dims'])
+        ds.attrs['granule'] = os.path.basename(str(granule['filename']))
+        ds.attrs['model'] = self.model_name
+
+        if self.output_dir is None:
+            self.results[granule['filename']] = ds
+        else:
+            name = os.path.splitext(os.path.basename(str(granule['filename'])))[0] + '.nn.nc'
+            encoding = {v:{'zlib':True,'complevel':1} for v in ds.data_vars}
+            ds.to_netcdf(os.path.join(self.output_dir,name),encoding=encoding)
+            self.results[granule['filename']] = os.path.join(self.output_dir,name)
+        self.stats['granules'] += 1
+        self.stats['gates'] += int(mask.sum())
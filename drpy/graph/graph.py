@@ -31,19 +31,19 @@ class case_study:
   def __init__(self,filename=None,center_lat=None,center_lon=None,path_to_models='../models/'):
 
     import drpy 
-    dpr = drpy.core.GPMDPR(filename=filename)
-    dpr.read()
-    dpr.parse_dtime()
     #if no center point is given, use middle of orbit. 
     if (center_lat is None) or (center_lon is None):
-        #determine map center
+        #determine map center, only need the geolocation for this 
+        geo = drpy.core.GPMDPR(filename=filename,variables=[])
         s = 0 
-        e = dpr.ds.Longitude.shape[0]
+        e = geo.ds.Longitude.shape[0]
         middle = int((e-s)/2)
-        center_lon = dpr.ds.Longitude.values[middle,24]
-        center_lat = dpr.ds.Latitude.values[middle,24]
+        center_lon = geo.ds.Longitude.values[middle,24]
+        center_lat = geo.ds.Latitude.values[middle,24]
+        geo.close()
     corners = [center_lon - 5,center_lon + 5,center_lat-5,center_lat+5]
-    dpr.corners = corners
+    #only read the scans that go through the box 
+    dpr = drpy.core.GPMDPR(filename=filename,bounding_box=corners)
     dpr.setboxcoords()
     #drop dead weight (i.e. blank data)
     dpr.ds = dpr.ds.dropna(dim='nscan',how='all')
@@ -150,7 +150,7 @@ class case_study:
     inset_axis.plot(self.dpr.ds.Longitude[:,0]+0.0485,self.dpr.ds.Latitude[:,0],'--k',lw=0.5,)
     inset_axis.plot(self.dpr.ds.Longitude[:,-1]-0.0485,self.dpr.ds.Latitude[:,-1],'--k',lw=0.5,)
     inset_axis.plot([corners[0],corners[0],corners[1],corners[1],corners[0]],[corners[2],corners[3],corners[3],corners[2],corners[2]],'-',color='orangered')
-    timestr = pd.to_datetime(self.dpr.ds.time[middle,24].values).strftime(format='%Y-%m-%d %H:%M')
+    timestr = pd.to_datetime(self.dpr.ds.time[middle].values).strftime(format='%Y-%m-%d %H:%M')
     text = inset_axis.text(-0.05,-0.2,'Scan Time: ' + timestr,transform=ax.transAxes,fontsize=10)
     text.set_path_effects([PathEffects.withStroke(linewidth=3, foreground="w")])
     text = inset_axis.text(0.025,-0.275,'Created with DRpy',transform=ax.transAxes,fontsize=10)
@@ -339,7 +339,7 @@ class case_study:
     inset_axis.plot(self.dpr.ds.Longitude[:,0]+0.0485,self.dpr.ds.Latitude[:,0],'--k',lw=0.5,)
     inset_axis.plot(self.dpr.ds.Longitude[:,-1]-0.0485,self.dpr.ds.Latitude[:,-1],'--k',lw=0.5,)
     inset_axis.plot([corners[0],corners[0],corners[1],corners[1],corners[0]],[corners[2],corners[3],corners[3],corners[2],corners[2]],'-',color='orangered')
-    timestr = pd.to_datetime(self.dpr.ds.time[middle,24].values).strftime(format='%Y-%m-%d %H:%M')
+    timestr = pd.to_datetime(self.dpr.ds.time[middle].values).strftime(format='%Y-%m-%d %H:%M')
     text = inset_axis.text(-0.05,-0.2,'Scan Time: ' + timestr,transform=ax.transAxes,fontsize=10)
     text.set_path_effects([PathEffects.withStroke(linewidth=3, foreground="w")])
     text = inset_axis.text(0.025,-0.275,'Created with DRpy',transform=ax.transAxes,fontsize=10)
@@ -1,2 +1,4 @@
 from __future__ import absolute_import
-from .io import *
\ No newline at end of file
+from .io import *
+from .pipeline import Pipeline
+from .aio import AsyncNetrunner, AsyncHTTPPool
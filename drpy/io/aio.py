@@ -0,0 +1,412 @@
+"""
+asyncio versions of the PPS client and netrunner, for programs that already run an event loop.
+
+The HTTP client is built on asyncio streams (asyncio.open_connection), so nothing extra has to be installed and
+nothing blocks the loop while waiting on the network. It works like transfer.HTTPPool: connections are kept
+alive and reused, each host gets at most max_per_host, downloads go to a .part file that is picked up where it
+left off, and files are checked (size, checksum, HDF5 signature) before they show up under their real name.
+Thousands of listings and downloads can be going on one loop, the semaphores decide how many actually run.
+
+e.g.,
+
+    async def main():
+        io = drpy.io.AsyncNetrunner(servername='Research',username='username@email.com',start_time=start,end_time=end)
+        await io.get_file_list()
+        await io.locate_file()
+        async for result in io.granules(savedir='./'):
+            print(result.path,result.ok)
+        await io.close()
+
+    asyncio.run(main())
+"""
+from __future__ import absolute_import
+import asyncio
+import base64
+import collections
+import os
+import ssl
+import time
+from urllib.parse import urlsplit
+from .io import netrunner
+from .transfer import DownloadResult, Part, Tries, keep_existing, plan_response, finish_response
+
+class HTTPError(IOError):
+    """ the server answered, but not with what we wanted """
+
+class AsyncHTTPPool():
+
+    """
+    A pool of keep-alive HTTP(S) connections for one event loop. Each host gets at most max_per_host connections,
+    requests past that wait (without blocking the loop) for one to free up.
+    """
+
+    def __init__(self,username=None,password=None,max_per_host=4,timeout=60,buffer_size=2**20):
+        """
+        params::
+        username: str, PPS registered email (PPS uses it as the password too)
+        password: str, defaults to the username
+        max_per_host: int, most connections open to one host at a time
+        timeout: float, seconds to wait on the socket (connecting or reading one block) before giving up
+        buffer_size: int, bytes read from the socket (and written to disk) at a time
+        """
+        self.headers = {'Connection':'keep-alive','User-Agent':'drpy'}
+        if username is not None:
+            if password is None:
+                password = username
+            token = base64.b64encode('{}:{}'.format(username,password).encode()).decode()
+            self.headers['Authorization'] = 'Basic ' + token
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.buffer_size = buffer_size
+        self.idle = collections.defaultdict(list)
+        self.slots = {}
+        self.ssl = None
+
+    def slot(self,host):
+        """ the semaphore that limits the connections to one host """
+        if host not in self.slots:
+            self.slots[host] = asyncio.Semaphore(self.max_per_host)
+        return self.slots[host]
+
+    async def connect(self,scheme,host):
+        """ an idle connection (reader,writer) to host if there is one, otherwise a new one. Also returns True if it was reused """
+        while len(self.idle[(scheme,host)]) > 0:
+            reader,writer = self.idle[(scheme,host)].pop()
+            if not (writer.is_closing() or reader.at_eof()):
+                return reader,writer,True
+            writer.close()
+        hostname,_,port = host.partition(':')
+        if scheme == 'https':
+            if self.ssl is None:
+                self.ssl = ssl.create_default_context()
+            conn = asyncio.open_connection(hostname,int(port or 443),ssl=self.ssl,server_hostname=hostname)
+        else:
+            conn = asyncio.open_connection(hostname,int(port or 80))
+        reader,writer = await asyncio.wait_for(conn,self.timeout)
+        return reader,writer,False
+
+    async def read_head(self,reader):
+        """ read the status line and headers of a response. Returns (status, reason, headers with lowercase names) """
+        line = await asyncio.wait_for(reader.readline(),self.timeout)
+        if not line:
+            raise ConnectionResetError('server closed the connection')
+        parts = line.decode('latin-1').split(None,2)
+        status = int(parts[1])
+        reason = parts[2].strip() if len(parts) > 2 else ''
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(),self.timeout)
+            line = line.decode('latin-1').strip()
+            if line == '':
+                break
+            name,_,value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return status,reason,headers
+
+    async def body(self,reader,method,status,headers):
+        """ the body of a response, a block at a time (an async generator) """
+        if (method == 'HEAD') or (status in (204,304)) or (100 <= status < 200):
+            return
+        if headers.get('transfer-encoding','').lower() == 'chunked':
+            while True:
+                line = await asyncio.wait_for(reader.readline(),self.timeout)
+                if not line.strip():
+                    #the server hung up (or sent garbage) where a chunk size should be, not the last chunk
+                    raise asyncio.IncompleteReadError(line,None)
+                n = int(line.split(b';')[0].strip(),16)
+                if n == 0:
+                    #trailers, up to the blank line
+                    while (await asyncio.wait_for(reader.readline(),self.timeout)).strip():
+                        pass
+                    return
+                yield await asyncio.wait_for(reader.readexactly(n),self.timeout)
+                await asyncio.wait_for(reader.readexactly(2),self.timeout)
+        elif 'content-length' in headers:
+            left = int(headers['content-length'])
+            while left > 0:
+                block = await asyncio.wait_for(reader.read(min(left,self.buffer_size)),self.timeout)
+                if not block:
+                    raise asyncio.IncompleteReadError(block,left)
+                left -= len(block)
+                yield block
+        else:
+            #no length, the body ends when the server hangs up
+            while True:
+                block = await asyncio.wait_for(reader.read(self.buffer_size),self.timeout)
+                if not block:
+                    return
+                yield block
+
+    async def request(self,url,handle,method='GET',headers=None):
+        """
+        Send one request and pass the response to handle(status,reason,headers,blocks) (a coroutine, blocks is an async
+        generator of the body), while holding one of the host's connections. A kept-alive connection the server already
+        dropped is retried once on a fresh one. If this is cancelled partway the connection is closed, not reused.
+
+        returns whatever handle returns
+        """
+        parts = urlsplit(url)
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        h = dict(self.headers)
+        h['Host'] = parts.netloc
+        if headers is not None:
+            h.update(headers)
+        message = '{} {} HTTP/1.1\r\n'.format(method,path) + ''.join(['{}: {}\r\n'.format(k,v) for k,v in h.items()]) + '\r\n'
+        async with self.slot(parts.netloc):
+            for attempt in range(2):
+                reader,writer,reused = await self.connect(parts.scheme,parts.netloc)
+                try:
+                    writer.write(message.encode('latin-1'))
+                    await writer.drain()
+                    status,reason,response_headers = await self.read_head(reader)
+                except (ConnectionError,asyncio.IncompleteReadError):
+                    #a kept-alive connection that timed out on the server side, try again with a new one
+                    writer.close()
+                    if (attempt == 1) or (not reused):
+                        raise
+                    continue
+                except BaseException:
+                    writer.close()
+                    raise
+                blocks = self.body(reader,method,status,response_headers)
+                try:
+                    result = await handle(status,reason,response_headers,blocks)
+                    #read whatever is left so the connection can be used again
+                    async for block in blocks:
+                        pass
+                except BaseException:
+                    writer.close()
+                    raise
+                closing = (response_headers.get('connection','').lower() == 'close') or \
+                          (('content-length' not in response_headers) and
+                           (response_headers.get('transfer-encoding','').lower() != 'chunked') and (method != 'HEAD'))
+                if closing:
+                    writer.close()
+                else:
+                    self.idle[(parts.scheme,parts.netloc)].append((reader,writer))
+                return result
+
+    async def get_text(self,url):
+        """ GET a (text) page. Raises HTTPError if the server does not give back 200 """
+        async def handle(status,reason,headers,blocks):
+            body = b''.join([block async for block in blocks])
+            if status != 200:
+                raise HTTPError('{} {} for {}'.format(status,reason,url))
+            return body.decode('utf-8','replace')
+        return await self.request(url,handle)
+
+    async def remote_size(self,url):
+        """ size of a file on the server (from a HEAD request), None if the server does not say """
+        async def handle(status,reason,headers,blocks):
+            if (status != 200) or ('content-length' not in headers):
+                return None
+            return int(headers['content-length'])
+        try:
+            return await self.request(url,handle,method='HEAD')
+        except (OSError,asyncio.TimeoutError,ValueError):
+            return None
+
+    async def download(self,url,path,size=None,checksum=None,retries=3,backoff=1.0,progress=None):
+        """
+        Stream url to path, the same way as transfer.HTTPPool.download (same params, same Tries), without blocking
+        the loop. Checking files (hashing them) is done in a thread.
+
+        returns a DownloadResult
+        """
+        loop = asyncio.get_running_loop()
+        t0 = time.perf_counter()
+        #skip it if we already have the whole thing (see transfer.keep_existing)
+        if os.path.exists(path):
+            expected = size if size is not None else await self.remote_size(url)
+            if await loop.run_in_executor(None,keep_existing,path,expected,checksum):
+                return DownloadResult(url,path,True,None,0,time.perf_counter() - t0,None,0,True)
+
+        tries = Tries(Part(path),size,retries,backoff)
+        for attempt in tries:
+            await asyncio.sleep(tries.delay(attempt))
+            start = tries.start(attempt)
+            async def handle(status,reason,headers,blocks):
+                return await self.receive(status,reason,headers,blocks,tries.part,start,progress)
+            try:
+                outcome = await self.request(url,handle,headers=tries.headers(start))
+            except (OSError,asyncio.TimeoutError,asyncio.IncompleteReadError,ValueError) as e:
+                tries.dropped(e,start)
+                continue
+            if tries.received(*outcome):
+                tries.checked(await loop.run_in_executor(None,tries.part.check,tries.expected(),checksum))
+        return tries.result(url)
+
+    async def receive(self,status,reason,headers,blocks,part,start,progress=None):
+        """
+        Write the body of a (possibly ranged) response to part, like transfer.HTTPPool.receive.
+
+        returns (status, bytes written, total size of the file, error, True if trying again would not help)
+        """
+        start,total,outcome = plan_response(part,start,status,reason,headers.get('content-range'),headers.get('content-length'))
+        if outcome is not None:
+            return outcome
+        n = 0
+        with part.open(start) as f:
+            async for block in blocks:
+                f.write(block)
+                n += len(block)
+                if progress is not None:
+                    progress(start + n,total)
+        return finish_response(status,start,n,total)
+
+    async def close(self):
+        """ close all the idle connections """
+        for conns in self.idle.values():
+            for reader,writer in conns:
+                writer.close()
+        self.idle.clear()
+
+class AsyncNetrunner():
+
+    """
+    netrunner for asyncio. get_file_list, locate_file and download are coroutines, and granules is an async iterator
+    that hands back each file as it finishes. At most n_workers listings/downloads run at once (and at most
+    max_per_host connections to the server), each file gets file_timeout seconds, and cancelling the task that
+    is downloading stops everything cleanly (what made it is kept in .part files for next time).
+
+    Reading the listings and picking the files is left to a netrunner (self.runner), the files it found and picked
+    (file_list, file_info, catalog, filename) can be read and set here as well. Unlike netrunner nothing runs when it
+    is made (there is no loop yet), so there is no autorun. The blocking extras of netrunner (stream, sync, Pipeline)
+    are not here, they can be used on self.runner (with its own connections) if need be.
+    """
+
+    #attributes that live on self.runner
+    SHARED = ('servername','server','s_time','e_time','mirror','file_list','file_info','catalog','filename')
+
+    def __init__(self,servername='NearRealTime',username=None,start_time=None,end_time=None,savedir='./',verbose=True,
+                 n_workers=4,max_per_host=4,server=None,mirror=None,file_timeout=None):
+        """
+        params::
+        same as netrunner, plus
+        file_timeout: float, seconds one file (or listing) gets before it is given up on (None for no limit)
+        """
+        self.runner = netrunner(servername=servername,username=username,start_time=start_time,end_time=end_time,
+                                autorun=False,savedir=savedir,verbose=verbose,n_workers=n_workers,
+                                max_per_host=max_per_host,server=server,mirror=mirror)
+        self.savedir = savedir
+        self.verbose = verbose
+        self.n_workers = n_workers
+        self.file_timeout = file_timeout
+        self.apool = AsyncHTTPPool(username=username,max_per_host=max_per_host)
+        self.limit = None
+
+    def __getattr__(self,name):
+        if name in AsyncNetrunner.SHARED:
+            return getattr(self.runner,name)
+        raise AttributeError("'AsyncNetrunner' object has no attribute '{}'".format(name))
+
+    def __setattr__(self,name,value):
+        if name in AsyncNetrunner.SHARED:
+            setattr(self.runner,name,value)
+        else:
+            object.__setattr__(self,name,value)
+
+    def semaphore(self):
+        """ the semaphore that caps how many things run at once (made on first use, so it belongs to the running loop) """
+        if self.limit is None:
+            self.limit = asyncio.Semaphore(self.n_workers)
+        return self.limit
+
+    async def get_listing(self,url):
+        """ the listing of one folder, '' (with a warning) if it can't be listed (e.g., a day with no data yet) """
+        async with self.semaphore():
+            try:
+                return await asyncio.wait_for(self.apool.get_text(url),self.file_timeout)
+            except (OSError,asyncio.TimeoutError,ValueError) as e:
+                print('Warning, could not list {}: {!r}'.format(url,e))
+                return ''
+
+    async def get_file_list(self):
+        """
+        Same as netrunner.get_file_list (which folders to list and which files to keep come from self.runner), with 
+        all the day folders listed at the same time on the loop
+        """
+        runner = self.runner
+        urls = runner.listing_urls()
+        if runner.servername=='NearRealTime':
+            async with self.semaphore():
+                listings = [await asyncio.wait_for(self.apool.get_text(urls[0]),self.file_timeout)]
+        else:
+            listings = await asyncio.gather(*[self.get_listing(url) for url in urls])
+        runner.file_list = runner.files_from_listings(listings)
+
+    async def locate_file(self):
+        """ Same as netrunner.locate_file (there is no waiting on the network here) """
+        return self.runner.locate_file()
+
+    async def download_one(self,job,retries=3):
+        """
+        Download one file (a job from netrunner.get_jobs) within file_timeout, using the mirror if there is one
+        (like netrunner.download_one).
+
+        returns a DownloadResult
+        """
+        loop = asyncio.get_running_loop()
+        mirror = self.runner.mirror
+        if mirror is not None:
+            url,path,size,checksum = job
+            if (size is None) and (checksum is None):
+                size = await self.apool.remote_size(url)
+            if ((size is not None) or (checksum is not None)) and \
+               (await loop.run_in_executor(None,mirror.link,path,path,size,checksum) is not None):
+                return DownloadResult(url,path,True,None,0,0.,None,0,True)
+        t0 = time.perf_counter()
+        async with self.semaphore():
+            try:
+                result = await asyncio.wait_for(self.apool.download(*job,retries=retries),self.file_timeout)
+            except asyncio.TimeoutError:
+                result = DownloadResult(job[0],job[1],False,None,0,time.perf_counter() - t0,
+                                        'timed out after {} s'.format(self.file_timeout),0,False)
+        if (mirror is not None) and result.ok:
+            await loop.run_in_executor(None,lambda: mirror.add(result.path,checksum=job[3]))
+        return result
+
+    async def granules(self,savedir=None,retries=3):
+        """
+        Download the files in self.filename into savedir and hand back each DownloadResult as soon as it is done
+        (an async iterator, not in order). If you stop iterating early, the downloads still going are cancelled.
+
+        params::
+        savedir: str, folder to download to (defaults to the one given when this was made)
+        retries: int, times to try again if the connection drops
+        """
+        jobs = self.runner.get_jobs(self.savedir if savedir is None else savedir)
+        tasks = [asyncio.ensure_future(self.download_one(job,retries=retries)) for job in jobs]
+        try:
+            for future in asyncio.as_completed(tasks):
+                result = await future
+                if self.verbose:
+                    if result.skipped:
+                        print('Already have: {}'.format(result.path))
+                    elif result.ok:
+                        print('Downloaded: {} ({:.1f} MB in {:.1f} s)'.format(result.url,result.nbytes/2**20,result.seconds))
+                    else:
+                        print('FAILED: {} ({})'.format(result.url,result.error))
+                yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks,return_exceptions=True)
+
+    async def download(self,savedir=None,retries=3):
+        """
+        Same as netrunner.download, on the loop.
+
+        returns a list of DownloadResult in the same order as self.filename, also kept in self.results
+        """
+        results = {}
+        async for result in self.granules(savedir,retries=retries):
+            results[result.url] = result
+        self.results = [results[self.runner.server + file] for file in self.runner.filename]
+        if self.verbose:
+            print('Done, {} of {} files downloaded'.format(sum([r.ok for r in self.results]),len(self.results)))
+        return self.results
+
+    async def close(self):
+        """ close the idle connections """
+        await self.apool.close()
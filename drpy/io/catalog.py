@@ -0,0 +1,81 @@
+"""
+Turn lists of GPM granule paths into a table you can search by time.
+
+The file names follow the PPS convention, e.g.,
+
+    2A.GPM.DPR.V9-20211125.20220220-S003549-E020820.045337.V07A.HDF5   (Research)
+    2A.GPM.DPR.V920211125.20220220-S151128-E154127.V07A.RT-H5          (NearRealTime, no orbit number)
+
+(level, satellite, sensor, algorithm, date-Sstart-Eend, orbit number, version). They are parsed with one regular
+expression over the whole list at once, so it does not matter which version or server they came from.
+"""
+from __future__ import absolute_import
+import os
+import re
+import numpy as np
+import pandas as pd
+
+FILENAME_RE = re.compile(r'(?P<level>[0-9][A-Z])\.(?P<satellite>[A-Z0-9-]+)\.(?P<sensor>[A-Za-z0-9]+)\.(?P<algorithm>[^.]+)\.'
+                         r'(?P<date>\d{8})-S(?P<start>\d{6})-E(?P<end>\d{6})(?:\.(?P<orbit>\d{6}))?\.(?P<version>V\d{2}[A-Z]?)\.(?:HDF5|RT-H5)$')
+
+COLUMNS = ['product','algorithm','version','date','start','end','orbit','path','url']
+
+def build_catalog(paths,server=''):
+    """
+    Make a table of granules out of their paths (on a server or on disk).
+
+    params::
+    paths: list of str, paths or file names of granules. Anything that does not look like a granule is left out
+    server: str, put in front of each path to make the url column
+
+    returns a pandas DataFrame with product (e.g., '2A.DPR'), algorithm, version, date, start, end (datetime64),
+    orbit (Int64, <NA> for near real-time files, which have no orbit number), path and url columns, sorted by start time
+    """
+    paths = pd.Series(np.asarray(paths,dtype=str),dtype=object)
+    names = paths.map(os.path.basename)
+    parts = names.str.extract(FILENAME_RE)
+    good = parts['date'].notna().values
+    parts = parts[good]
+    paths = paths[good]
+
+    catalog = pd.DataFrame({'product':parts['level'] + '.' + parts['sensor'],
+                            'algorithm':parts['algorithm'],
+                            'version':parts['version'],
+                            'date':pd.to_datetime(parts['date'],format='%Y%m%d'),
+                            'start':pd.to_datetime(parts['date'] + parts['start'],format='%Y%m%d%H%M%S'),
+                            'end':pd.to_datetime(parts['date'] + parts['end'],format='%Y%m%d%H%M%S'),
+                            'orbit':pd.to_numeric(parts['orbit']).astype('Int64'),
+                            'path':paths.values,
+                            'url':server + paths.values},columns=COLUMNS)
+    #granules that go over midnight end on the next day
+    catalog.loc[catalog['end'] < catalog['start'],'end'] += pd.Timedelta(days=1)
+    return catalog.sort_values('start',kind='stable').reset_index(drop=True)
+
+def select(catalog,start_time=None,end_time=None,within=False):
+    """
+    The granules that have data in a time window.
+
+    params::
+    catalog: DataFrame from build_catalog
+    start_time: datetime, with no end_time this is the one time you want (the granule that has it)
+    end_time: datetime, end of the window. Every granule that overlaps start_time to end_time is picked
+    within: bool, with an end_time only pick the granules that are all the way inside the window (what netrunner 
+    does for the NearRealTime server)
+
+    returns the rows of catalog that were picked
+    """
+    if (start_time is None) and (end_time is None):
+        return catalog
+    if start_time is None:
+        start_time = end_time
+    if end_time is None:
+        end_time = start_time
+    start = catalog['start'].values
+    #the catalog is sorted by start, so everything that starts after the window is at the end
+    stop = np.searchsorted(start,np.datetime64(pd.Timestamp(end_time)),side='right')
+    if within and (start_time != end_time):
+        keep = (start[:stop] >= np.datetime64(pd.Timestamp(start_time))) & \
+               (catalog['end'].values[:stop] <= np.datetime64(pd.Timestamp(end_time)))
+    else:
+        keep = catalog['end'].values[:stop] >= np.datetime64(pd.Timestamp(start_time))
+    return catalog.iloc[:stop][keep]
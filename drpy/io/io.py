@@ -3,8 +3,16 @@ import sys
 import subprocess
 import os
 import numpy as np
-import datetime
+import collections
+import itertools
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
 from copy import deepcopy
+from .transfer import HTTPPool, DownloadResult
+from .mirror import GranuleMirror
+from .catalog import build_catalog, select
 
 def padder(x):
     
@@ -27,27 +35,45 @@ class netrunner():
     """ This class will house all the functions needed to query the GPM FTP"""
     
     def __init__(self,servername='NearRealTime',username=None,start_time=None,end_time=None,
-                    autorun=True,savedir='./',verbose=True):
+                    autorun=True,savedir='./',verbose=True,n_workers=4,max_per_host=4,server=None,mirror=None):
+        """
+        params::
+        servername: str, 'NearRealTime' or 'Research'
+        username: str, your PPS registered email 
+        start_time: datetime, time you want (or the start of the window you want)
+        end_time: datetime, end of the window you want. Can be any number of days after start_time 
+        savedir: str, folder to download to 
+        n_workers: int, number of files downloaded (or day folders listed) at the same time 
+        max_per_host: int, most connections open to the server at once (connections are kept open and reused)
+        server: str, use a different server than the servername one (e.g., a mirror or a local test server)
+        mirror: str or GranuleMirror, a local mirror (see drpy.io.mirror) to check before downloading and to add downloads to. 
+        Files in it are linked into savedir instead of being downloaded again 
+        """
         self.servername = servername
         if servername=='NearRealTime':
             self.server ='https://jsimpsonhttps.pps.eosdis.nasa.gov/text'
         elif servername=='Research':
             self.server = 'https://arthurhouhttps.pps.eosdis.nasa.gov/text'
+        if server is not None:
+            self.server = server.rstrip('/')
         self.s_time = start_time
         self.e_time = end_time
         self.verbose = verbose 
+        self.n_workers = n_workers
+        if isinstance(mirror,str):
+            mirror = GranuleMirror(mirror)
+        self.mirror = mirror
 
         #check username input 
         if username is None:
             print('Please enter your PPS registered email as the username')
-        else:
-            self.username=username
-        
-        #check dates, multi-day not supported 
-        if self.e_time is not None:
-            if self.s_time.day != self.e_time.day:
-                print('More than one day given as input!')
-                print('Multi-day downloads are not currently supported')
+        self.username=username
+        self.max_per_host = max_per_host
+        self._pool = None
+
+        #check dates 
+        if (self.e_time is not None) and (self.s_time is not None) and (self.e_time < self.s_time):
+            print('Warning, end_time is before start_time, no files will be found')
 
         if autorun:
             #this will grab all the files on your day of interest
@@ -57,41 +83,91 @@ class netrunner():
             #this will download it locally
             self.download(savedir=savedir)
         
+    @property
+    def pool(self):
+        """ the HTTPPool everything goes through (made on first use, so a netrunner that never talks to the server has none) """
+        if self._pool is None:
+            self._pool = HTTPPool(username=self.username,max_per_host=self.max_per_host)
+        return self._pool
+
     def get_file_list(self):
         """ 
         Code to grab files that are on the servers to let the user decide which files they want
         """
+        urls = self.listing_urls()
         if self.servername=='NearRealTime':
-            url = self.server + '/radar/DprL2/' 
-            cmd = 'curl -s -u ' + self.username+':'+self.username+' ' + url
-            self.cmd = cmd
-            args = cmd.split()
-            process = subprocess.Popen(args,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE)
-            stdout = process.communicate()[0].decode()
-            file_list = stdout.split()
-            file_list = find_keys(file_list,['2A.GPM.DPR.V920211125'])
-            
+            listings = [self.pool.get_text(url) for url in urls]
+        else:
+            #list every day folder at the same time (connections are shared), then put them together in order 
+            with ThreadPoolExecutor(max_workers=self.n_workers) as pool:
+                listings = list(pool.map(self.get_listing,urls))
+        self.file_list = self.files_from_listings(listings)
+
+    def listing_urls(self):
+        """ the folders that need to be listed, the one NearRealTime folder or every Research day folder (see get_days) """
+        if self.servername=='NearRealTime':
+            return [self.server + '/radar/DprL2/']
         elif self.servername=='Research':
-            server = 'https://arthurhouhttps.pps.eosdis.nasa.gov/text/'
-            year = padder(self.s_time.year)
-            month = padder(self.s_time.month)
-            day = padder(self.s_time.day)
-            dir_str = 'gpmdata/' + year + '/' + month + '/' + day + '/radar/' 
-            url = server + dir_str
-            cmd = 'curl -s -u ' + self.username+':'+self.username+' ' + url
-            self.cmd = cmd
-            args = cmd.split()
-            process = subprocess.Popen(args,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE)
-            stdout = process.communicate()[0].decode()
-            file_list = stdout.split()
-            file_list = find_keys(file_list,['2A.GPM.DPR.V9-20211125'])
-                
-        self.file_list = file_list 
-        
+            return [self.server + self.day_dir(day) for day in self.get_days()]
+        raise ValueError("Unknown servername {}, pick 'NearRealTime' or 'Research'".format(self.servername))
+
+    def files_from_listings(self,listings):
+        """ the 2A.DPR granules (of the version this server has) out of the listings, in order and only once each """
+        file_list = []
+        for listing in listings:
+            file_list += self.parse_listing(listing)
+        file_list = list(dict.fromkeys(file_list))
+        if self.servername=='NearRealTime':
+            return find_keys(file_list,['2A.GPM.DPR.V920211125'])
+        return find_keys(file_list,['2A.GPM.DPR.V9-20211125'])
+
+    def get_days(self):
+        """
+        The days whose folders need to be listed to cover start_time to end_time. The day before start_time is 
+        included because a granule that starts before midnight lives in that day's folder. 
+        """
+        if self.s_time is None:
+            raise ValueError('The Research server is listed one day folder at a time, so it needs a start_time (and end_time for a range)')
+        start = pd.Timestamp(self.s_time).normalize() - pd.Timedelta(days=1)
+        end = pd.Timestamp(self.e_time if self.e_time is not None else self.s_time).normalize()
+        return list(pd.date_range(start,end,freq='D'))
+
+    def day_dir(self,day):
+        """ the Research server folder of one day """
+        return '/gpmdata/' + padder(day.year) + '/' + padder(day.month) + '/' + padder(day.day) + '/radar/' 
+
+    def get_listing(self,url):
+        """ the listing of one folder, '' (with a warning) if it can't be listed (e.g., a day with no data yet) """
+        try:
+            return self.pool.get_text(url)
+        except Exception as e:
+            print('Warning, could not list {}: {}'.format(url,e))
+            return ''
+
+    def parse_listing(self,text):
+        """
+        Pull the file paths out of a server listing (one path per line). If a line also has the size (bytes), a 
+        checksum ('md5:...') and/or when it was last modified (e.g., '2022-02-20T03:12:00'), they are kept in 
+        self.file_info so downloads can be checked against them (and sync can tell when a file changed). 
+        """
+        if not hasattr(self,'file_info'):
+            self.file_info = {}
+        file_list = []
+        for line in text.splitlines():
+            parts = line.split()
+            if len(parts) == 0:
+                continue
+            info = {'size':None,'checksum':None,'modified':None}
+            for part in parts[1:]:
+                if part.isdigit():
+                    info['size'] = int(part)
+                elif re.match(r'^\d{4}-\d{2}-\d{2}',part):
+                    info['modified'] = part
+                elif ':' in part:
+                    info['checksum'] = part
+            file_list.append(parts[0])
+            self.file_info[parts[0]] = info
+        return file_list
         
     def get_file(username,filename,server='https://jsimpsonhttps.pps.eosdis.nasa.gov/text'):
         """ Some bit of code modified from here: 
@@ -117,128 +193,185 @@ class netrunner():
 
     def locate_file(self):
         """ 
-        This is a method that will grab the desired GPM-DPR files from the NRT server
-        username: your email you signed up for the PPS server (string)
-        start_time: datetime of when you want to start looking 
-        end_time: datetime of when you end looking
+        This is a method that will pick the desired GPM-DPR files out of self.file_list. All the file names are put 
+        into a table (self.catalog, see drpy.io.catalog) and then 
+
+        with only start_time: the file that has that time is picked 
+        with start_time and end_time: all the files with data between them are picked (on the NearRealTime server, 
+        only the files that are all the way between them, like it has always been) 
+
+        The picked files end up in self.filename 
         """ 
-        
-        if self.servername=='NearRealTime':
-            s_times = []
-            e_times = []
-            date = []
-            for i in self.file_list:
-                t = i.split('S')[1][:14].split('-E')
-                s_times.append(t[0])
-                e_times.append(t[1])
-                #this is for the old version RJC 06-Dec-2021
-                #date.append(i.split('/radar/DprL2/2A.GPM.DPR.V820180723.')[1].split('-S')[0])
-                #new version string start RJC 06-Dec-2021
-                date.append(i.split('/radar/DprL2/2A.GPM.DPR.V920211125.')[1].split('-S')[0])
-                
-                res = [i + j for i, j in zip(date, s_times)] 
-                dtimes_s = np.zeros(len(res),dtype='object')
-                res2 = [i + j for i, j in zip(date, e_times)] 
-                dtimes_e = np.zeros(len(res),dtype='object')
-            for i,ii in enumerate(res):
-                dtimes_s[i] = datetime.datetime.strptime(ii,'%Y%m%d%H%M%S')
-                dtimes_e[i] = datetime.datetime.strptime(res2[i],'%Y%m%d%H%M%S')
-
-                if dtimes_s[i] > dtimes_e[i]:
-                    dtimes_e[i] = dtimes_e[i] + datetime.timedelta(days=1)
-
-
-            self.file_list = np.asarray(self.file_list,dtype=str)
-            if (self.s_time is None) and (self.e_time is None):
-                print('Warning, not time range selected. All filenames are returned')
-                return self.file_list
-            elif self.e_time is None:
-                ind_l = np.where(dtimes_s <= self.s_time)
-                ind_r = np.where(dtimes_e >= self.s_time)
-                ind_b = np.intersect1d(ind_l,ind_r)
-                self.filename = self.file_list[ind_b]
-            else:
-                ind_l = np.where(dtimes_s >= self.s_time)
-                ind_r = np.where(dtimes_e <= self.e_time)
-                ind_b = np.intersect1d(ind_l,ind_r)
-                self.filename = self.file_list[ind_b]
-            
-        elif self.servername=='Research':
-            
-            s_times = []
-            e_times = []
-            date = []
-            for i in self.file_list:
-                t = i.split('S')[1][:14].split('-E')
-                s_times.append(t[0])
-                e_times.append(t[1])
-                #V7 fix 
-                date.append(i.split('2A.GPM.DPR.V9-20211125.')[1].split('-S')[0])
-
-                res = [i + j for i, j in zip(date, s_times)] 
-                dtimes_s = np.zeros(len(res),dtype='object')
-                res2 = [i + j for i, j in zip(date, e_times)] 
-                dtimes_e = np.zeros(len(res),dtype='object')
-            for i,ii in enumerate(res):
-                dtimes_s[i] = datetime.datetime.strptime(ii,'%Y%m%d%H%M%S')
-                dtimes_e[i] = datetime.datetime.strptime(res2[i],'%Y%m%d%H%M%S')
-
-                if dtimes_s[i] > dtimes_e[i]:
-                    dtimes_e[i] = dtimes_e[i] + datetime.timedelta(days=1)
-
-
-            self.file_list = np.asarray(self.file_list,dtype=str)
-            if (self.s_time is None) and (self.e_time is None):
-                print('Warning, not time range selected. All filenames are returned')
-                return self.file_list
-            elif self.e_time is None:
-                ind_l = np.where(dtimes_s <= self.s_time)
-                ind_r = np.where(dtimes_e >= self.s_time)
-                ind_b = np.intersect1d(ind_l,ind_r)
-                self.filename = self.file_list[ind_b]
-            else:
-                ind_l = np.where(dtimes_e >= self.s_time)
-                ind_r = np.where(dtimes_s <= self.e_time)
-                ind_b = np.intersect1d(ind_l,ind_r)
-                self.filename = self.file_list[ind_b]
-
-    def download(self,savedir='./'):
-        for i,file in enumerate(self.filename):
-            url = self.server + file
-            if self.verbose:
-                print('Downloading {} of {}: {}'.format(i+1,len(self.filename),url))
-
-            cmd = 'curl -u ' + self.username+':'+self.username+' ' + url + ' -o ' + \
-            os.path.basename(savedir+file)
-            args = cmd.split()
-            process = subprocess.Popen(args,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=False,
-            universal_newlines=True)
-
-            # outs, errs = process.communicate()
-            # print(outs,errs)
-            # process.wait()
+        self.catalog = build_catalog(self.file_list,server=self.server)
+        self.file_list = np.asarray(self.file_list,dtype=str)
+        if (self.s_time is None) and (self.e_time is None):
+            print('Warning, not time range selected. All filenames are returned')
+            return self.file_list
+        self.filename = select(self.catalog,self.s_time,self.e_time,within=(self.servername=='NearRealTime'))['path'].to_numpy(dtype=str)
+
+    def download(self,savedir='./',retries=3):
+        """
+        This method downloads all the files in self.filename into savedir, n_workers at a time over kept-alive 
+        connections. Files are streamed to disk and only show up under their real name once they are complete and 
+        check out (size, checksum if the listing had one, and HDF5 signature). Files already there are skipped and 
+        downloads that died partway (a .part file is left) pick up where they left off. If there is a mirror, files 
+        in it are linked into savedir and everything downloaded is added to it. 
+
+        params::
+        savedir: str, folder to download to 
+        retries: int, times to try again if the connection drops 
+
+        returns a list of DownloadResult (ok, HTTP status, bytes, seconds and error of each file), also kept in self.results
+        """
+        jobs = self.get_jobs(savedir)
+        counter = itertools.count(1)
+        def report(result):
+            i = next(counter)
             if self.verbose:
-                it = -1 
-                while True:
-
-                    output = process.stderr.readline()
-                    if output == '' and process.poll() is not None:
-                        break
-                    if output:
-                        if it == -1:
-                            #need to print header 
-                            print(output.strip())
-                            it = 0
-                        else:
-                            print(output.strip(),end=' \r',)
-
-                rc = process.poll()
-            else:
-                process.wait()
-        
+                if result.skipped:
+                    print('Already have {} of {}: {}'.format(i,len(jobs),result.path))
+                elif result.ok:
+                    print('Downloaded {} of {}: {} ({:.1f} MB in {:.1f} s)'.format(i,len(jobs),result.url,
+                          result.nbytes/2**20,result.seconds))
+                else:
+                    print('FAILED {} of {}: {} ({})'.format(i,len(jobs),result.url,result.error))
+
+        def work(job):
+            result = self.download_one(job,retries=retries)
+            report(result)
+            return result
+        with ThreadPoolExecutor(max_workers=self.n_workers) as pool:
+            self.results = list(pool.map(work,jobs))
 
         if self.verbose:
-            print('Done')
+            print('Done, {} of {} files downloaded'.format(sum([r.ok for r in self.results]),len(self.results)))
+        return self.results
+
+    def get_jobs(self,savedir='./'):
+        """ (url, path in savedir, size, checksum) of each file in self.filename, size and checksum are None if the listing did not have them """
+        os.makedirs(savedir,exist_ok=True)
+        info = getattr(self,'file_info',{})
+        return [(self.server + file,os.path.join(savedir,os.path.basename(file)),info.get(file,{}).get('size'),
+                 info.get(file,{}).get('checksum')) for file in self.filename]
+
+    def download_one(self,job,retries=3):
+        """
+        Download one file (a job from get_jobs). If there is a mirror, the file is linked from it when it is there and 
+        matches the size/checksum from the listing (or the server's size if the listing has neither), and it is added 
+        to the mirror after it is downloaded. 
+
+        returns a DownloadResult
+        """
+        if self.mirror is not None:
+            #only use the mirror's copy if it is what the server has now
+            url,path,size,checksum = job
+            if (size is None) and (checksum is None):
+                size = self.pool.remote_size(url)
+            if ((size is not None) or (checksum is not None)) and (self.mirror.link(path,path,size,checksum) is not None):
+                return DownloadResult(url,path,True,None,0,0.,None,0,True)
+        result = self.pool.download(*job,retries=retries)
+        if (self.mirror is not None) and result.ok:
+            self.mirror.add(result.path,checksum=job[3])
+        return result
+
+    def stream(self,retries=3):
+        """
+        Download the files in self.filename into memory instead of onto disk, n_workers at a time, and hand them back 
+        one by one (in order) as they come in. Each buffer can go straight into GPMDPR, e.g., 
+
+            for result,buffer in io.stream():
+                dpr = drpy.core.GPMDPR(filename=buffer,variables=['precipRateNearSurface'],bounding_box=box).detach()
+
+        and once nothing points at the buffer anymore its memory is freed. At most n_workers + 1 files are in memory 
+        at once. Files are checked like in download (size, checksum if the listing had one, HDF5 signature). 
+
+        params::
+        retries: int, times to try again if the connection drops 
+
+        yields (DownloadResult, io.BytesIO) for each file. The buffer is None if the file could not be downloaded 
+        """
+        info = getattr(self,'file_info',{})
+        files = iter(self.filename)
+        with ThreadPoolExecutor(max_workers=self.n_workers) as pool:
+            def submit(file):
+                return pool.submit(self.pool.fetch,self.server + file,info.get(file,{}).get('size'),
+                                   info.get(file,{}).get('checksum'),retries=retries)
+            #keep n_workers going, start the next one as each is handed back 
+            futures = collections.deque([submit(file) for file in itertools.islice(files,self.n_workers)])
+            while len(futures) > 0:
+                result,buffer = futures.popleft().result()
+                file = next(files,None)
+                if file is not None:
+                    futures.append(submit(file))
+                if self.verbose:
+                    if result.ok:
+                        print('Streamed: {} ({:.1f} MB in {:.1f} s)'.format(result.url,result.nbytes/2**20,result.seconds))
+                    else:
+                        print('FAILED: {} ({})'.format(result.url,result.error))
+                yield result,buffer
+
+    def sync(self,savedir='./',manifest=None,retries=3):
+        """
+        Keep savedir up to date with the server, e.g., when polling the NearRealTime server on a schedule. The server is 
+        listed again and the listing is compared to a manifest of what was already downloaded (name, size, checksum and 
+        last modified, whatever the listing has). Only files that are new or changed are downloaded (n_workers at a time), 
+        so each call costs the listing plus the new bytes. The manifest is written to a temporary file and moved into 
+        place, so it is never left half written. 
+
+        If start_time/end_time were given only files in that window are kept up to date, otherwise everything listed 
+        (NearRealTime only, the Research server needs a start_time). A granule that changed is never taken from the 
+        mirror, it is always downloaded again. 
+
+        params::
+        savedir: str, folder to keep up to date 
+        manifest: str, the manifest file, defaults to savedir/drpy_manifest.json
+        retries: int, times to try again if the connection drops 
+
+        returns a list of DownloadResult for the files that were downloaded (also kept in self.results)
+        """
+        os.makedirs(savedir,exist_ok=True)
+        if manifest is None:
+            manifest = os.path.join(savedir,'drpy_manifest.json')
+        seen = {}
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                seen = json.load(f)
+
+        self.get_file_list()
+        if (self.s_time is None) and (self.e_time is None):
+            files = list(self.file_list)
+        else:
+            self.locate_file()
+            files = list(self.filename)
+
+        #new or changed since last time (or deleted locally)
+        info = getattr(self,'file_info',{})
+        changed = []
+        for file in files:
+            path = os.path.join(savedir,os.path.basename(file))
+            entry = info.get(file,{'size':None,'checksum':None,'modified':None})
+            if (seen.get(file) == entry) and os.path.exists(path):
+                continue
+            if file in seen:
+                #the old copy is out of date, don't keep (or resume) it, or link it back from the mirror 
+                for old in [path,path + '.part']:
+                    if os.path.exists(old):
+                        os.remove(old)
+                if self.mirror is not None:
+                    self.mirror.forget(file)
+            changed.append(file)
+
+        if self.verbose:
+            print('{} of {} files are new or changed'.format(len(changed),len(files)))
+        self.filename = np.asarray(changed,dtype=str)
+        results = self.download(savedir=savedir,retries=retries)
+
+        #only files that made it go in the manifest, the rest are tried again next time 
+        for file,result in zip(changed,results):
+            if result.ok:
+                seen[file] = info.get(file,{'size':None,'checksum':None,'modified':None})
+        tmp = manifest + '.tmp' + str(os.getpid())
+        with open(tmp,'w') as f:
+            json.dump(seen,f,indent=0,sort_keys=True)
+        os.replace(tmp,manifest)
+        return results
@@ -0,0 +1,202 @@
+from __future__ import absolute_import
+import os
+import shutil
+import stat
+import sqlite3
+import threading
+import time
+from .transfer import file_checksum
+
+def place(src,dest):
+    """ put a hard link to src at dest (a copy if they are on different disks), replacing whatever is there """
+    tmp = dest + '.tmp' + str(os.getpid()) + '.' + str(threading.get_ident())
+    try:
+        os.link(src,tmp)
+    except OSError:
+        shutil.copy2(src,tmp)
+    os.replace(tmp,dest)
+
+class GranuleMirror():
+
+    """
+    A local mirror of GPM granules that can be shared by many jobs (and users) on one machine.
+
+    Files are stored once by the sha256 of their contents (so two copies of the same granule only take up space once)
+    and looked up by name. netrunner checks the mirror before it downloads anything and adds what it downloads. Every
+    lookup marks the file as used, and when the mirror gets bigger than max_size the files used longest ago are deleted.
+
+    A file is only handed out if it is what you expect (the size and/or checksum from the listing), so a granule that
+    changed on the server since it was mirrored is downloaded again instead of the old copy being used.
+
+    Files handed out are hard links to the mirror's copy, so they are made read-only, and downloads never write into 
+    a file that is linked from somewhere else (see transfer.owned), they replace it with a new one. Otherwise one 
+    resumed download would change the mirror's copy and every other link to it. 
+
+    Layout::
+    root/objects/ab/abcdef...   the files, by content
+    root/mirror.sqlite          name -> content, sizes, checksums and last access times
+    """
+
+    def __init__(self,root='drpy_mirror',max_size=500*2**30):
+        """
+        params::
+        root: str, folder to keep the mirror in
+        max_size: int, bytes. Files used longest ago are deleted past this (None means no limit)
+        """
+        self.root = root
+        self.max_size = max_size
+        os.makedirs(os.path.join(root,'objects'),exist_ok=True)
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(os.path.join(root,'mirror.sqlite'),timeout=60,check_same_thread=False)
+        with self.lock, self.con:
+            self.con.executescript("""
+                CREATE TABLE IF NOT EXISTS objects (digest TEXT PRIMARY KEY, size INTEGER, last_access REAL);
+                CREATE TABLE IF NOT EXISTS names (name TEXT PRIMARY KEY, digest TEXT, added REAL);
+                CREATE TABLE IF NOT EXISTS checksums (digest TEXT, algorithm TEXT, value TEXT, PRIMARY KEY (digest, algorithm));
+                CREATE INDEX IF NOT EXISTS objects_access ON objects (last_access);
+                CREATE INDEX IF NOT EXISTS names_digest ON names (digest);
+                """)
+
+    def object_path(self,digest):
+        return os.path.join(self.root,'objects',digest[:2],digest)
+
+    def checksum(self,digest,algorithm):
+        """ hex checksum (e.g., md5) of a file in the mirror. Worked out the first time it is asked for, then kept """
+        if algorithm == 'sha256':
+            return digest
+        with self.lock:
+            row = self.con.execute('SELECT value FROM checksums WHERE digest = ? AND algorithm = ?',(digest,algorithm)).fetchone()
+        if row is not None:
+            return row[0]
+        value = file_checksum(self.object_path(digest),algorithm)
+        with self.lock, self.con:
+            self.con.execute('INSERT OR REPLACE INTO checksums VALUES (?,?,?)',(digest,algorithm,value))
+        return value
+
+    def lookup(self,name,size=None,checksum=None):
+        """
+        path of the granule called name (just the file name) in the mirror, None if it is not there or is not what
+        you expect.
+
+        params::
+        name: str, the granule
+        size: int, bytes it should have (None to not check)
+        checksum: str, 'algorithm:hexdigest' it should have (plain hex is taken as md5, None to not check)
+        """
+        name = os.path.basename(name)
+        with self.lock, self.con:
+            row = self.con.execute('SELECT names.digest, objects.size FROM names JOIN objects ON names.digest = objects.digest '
+                                   'WHERE names.name = ?',(name,)).fetchone()
+            if row is None:
+                return None
+            digest,n = row
+            path = self.object_path(digest)
+            if not os.path.exists(path):
+                #someone deleted it behind our back
+                self.con.execute('DELETE FROM names WHERE digest = ?',(digest,))
+                self.con.execute('DELETE FROM objects WHERE digest = ?',(digest,))
+                self.con.execute('DELETE FROM checksums WHERE digest = ?',(digest,))
+                return None
+        good = (size is None) or (n == size)
+        if good and (checksum is not None):
+            algorithm,value = checksum.split(':',1) if ':' in checksum else ('md5',checksum)
+            good = self.checksum(digest,algorithm).lower() == value.lower()
+        with self.lock, self.con:
+            if not good:
+                #this name has moved on (e.g., the granule was reprocessed), the old contents are left to be evicted
+                self.con.execute('DELETE FROM names WHERE name = ? AND digest = ?',(name,digest))
+                return None
+            self.con.execute('UPDATE objects SET last_access = ? WHERE digest = ?',(time.time(),digest))
+        return path
+
+    def forget(self,name):
+        """ drop the name (e.g., the granule changed on the server), its old contents are left to be evicted """
+        with self.lock, self.con:
+            self.con.execute('DELETE FROM names WHERE name = ?',(os.path.basename(name),))
+
+    def __contains__(self,name):
+        return self.lookup(name) is not None
+
+    def add(self,path,name=None,dedupe=True,checksum=None):
+        """
+        Put a file into the mirror.
+
+        params::
+        path: str, the file
+        name: str, the name to file it under (defaults to the file name of path)
+        dedupe: bool, if the mirror already had these contents, turn path into a link to that copy so the disk
+        space is only used once
+        checksum: str, 'algorithm:hexdigest' of the file if you already know it (e.g., from the listing), kept so it
+        does not have to be worked out again
+
+        returns the path of the file in the mirror
+        """
+        if name is None:
+            name = path
+        name = os.path.basename(name)
+        digest = file_checksum(path,'sha256')
+        size = os.path.getsize(path)
+        obj = self.object_path(digest)
+        if os.path.exists(obj):
+            if dedupe and not os.path.samefile(path,obj):
+                place(obj,path)
+        else:
+            os.makedirs(os.path.dirname(obj),exist_ok=True)
+            place(path,obj)
+            #nothing should write through a link to it
+            os.chmod(obj,stat.S_IMODE(os.stat(obj).st_mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+        now = time.time()
+        with self.lock, self.con:
+            self.con.execute('INSERT OR REPLACE INTO objects VALUES (?,?,?)',(digest,size,now))
+            self.con.execute('INSERT OR REPLACE INTO names VALUES (?,?,?)',(name,digest,now))
+            if checksum is not None:
+                algorithm,value = checksum.split(':',1) if ':' in checksum else ('md5',checksum)
+                self.con.execute('INSERT OR REPLACE INTO checksums VALUES (?,?,?)',(digest,algorithm,value.lower()))
+        self.evict(keep=digest)
+        return obj
+
+    def link(self,name,dest,size=None,checksum=None):
+        """
+        put the granule called name at dest (a hard link when possible). Returns dest, or None if it is not in the mirror
+        (or does not have the size/checksum given, see lookup)
+        """
+        obj = self.lookup(name,size,checksum)
+        if obj is None:
+            return None
+        if not (os.path.exists(dest) and os.path.samefile(obj,dest)):
+            place(obj,dest)
+        return dest
+
+    def size(self):
+        """ bytes in the mirror """
+        with self.lock:
+            return self.con.execute('SELECT COALESCE(SUM(size),0) FROM objects').fetchone()[0]
+
+    def evict(self,keep=None):
+        """ delete the files used longest ago until the mirror fits in max_size. Returns the number deleted """
+        if self.max_size is None:
+            return 0
+        n = 0
+        with self.lock, self.con:
+            total = self.con.execute('SELECT COALESCE(SUM(size),0) FROM objects').fetchone()[0]
+            if total <= self.max_size:
+                return 0
+            for digest,size in self.con.execute('SELECT digest, size FROM objects ORDER BY last_access').fetchall():
+                if total <= self.max_size:
+                    break
+                if digest == keep:
+                    continue
+                try:
+                    os.remove(self.object_path(digest))
+                except OSError:
+                    pass
+                self.con.execute('DELETE FROM objects WHERE digest = ?',(digest,))
+                self.con.execute('DELETE FROM names WHERE digest = ?',(digest,))
+                self.con.execute('DELETE FROM checksums WHERE digest = ?',(digest,))
+                total -= size
+                n += 1
+        return n
+
+    def close(self):
+        """ close the sqlite connection """
+        self.con.close()
@@ -0,0 +1,124 @@
+"""
+Download and process granules at the same time.
+
+Files are downloaded a few ahead of the ones being processed, and each one is handed to a pool of workers as soon as
+it is in. At most prefetch files are on disk (downloading, waiting or being processed) at a time, and once a file
+has been processed it is deleted (unless keep=True), so the disk use stays the same no matter how many files there
+are. A day of data takes about as long as the slower of downloading and processing, not the two added up.
+"""
+from __future__ import absolute_import
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+def timed(process,path):
+    """ run process(path) and time it (this is what the workers do) """
+    t = time.perf_counter()
+    return process(path),time.perf_counter() - t
+
+class Pipeline():
+
+    """
+    This class runs process(path) on every file picked by a netrunner (i.e., runner.filename after locate_file),
+    while the next ones download.
+
+    e.g.,
+
+        def rain(path):
+            dpr = drpy.core.GPMDPR(filename=path,variables=['precipRateNearSurface'])
+            return float(dpr.ds.precipRateNearSurface.where(dpr.ds.precipRateNearSurface > 0).mean())
+
+        io = drpy.io.netrunner(servername='Research',username='username@email.com',start_time=start,end_time=end,autorun=False)
+        io.get_file_list()
+        io.locate_file()
+        p = drpy.io.Pipeline(io,rain,savedir='./tmp/')
+        p.results  #path -> what rain gave back
+
+    With processes (the default) process has to be a function defined at the top of a module so it can be sent
+    to the workers.
+    """
+
+    def __init__(self,runner,process,savedir='./',prefetch=8,n_workers=None,processes=True,keep=False,retries=3,auto_run=True):
+        """
+        Initializes things
+
+        params::
+        runner: netrunner, with the files picked (runner.filename). Its n_workers, connections and mirror are used for downloading
+        process: function(path), what to do with each file. What it returns ends up in self.results
+        savedir: str, folder to download to
+        prefetch: int, most files on disk at once. Should be at least n_workers so the workers are never waiting
+        n_workers: int, number of files processed at the same time. Defaults to the number of cores
+        processes: bool, process in a pool of processes (True) or threads (False)
+        keep: bool, keep the files after they are processed. Files that were in savedir before are always kept
+        retries: int, times to try again if the connection drops
+        """
+        self.runner = runner
+        self.process = process
+        self.savedir = savedir
+        self.n_workers = n_workers or os.cpu_count()
+        self.prefetch = max(prefetch,1)
+        self.processes = processes
+        self.keep = keep
+        self.retries = retries
+        self.results = {}
+        self.downloads = {}
+        self.stats = {}
+
+        if auto_run:
+            self.run()
+
+    def run(self):
+        """
+        This method downloads and processes everything. Downloads only start when there is room (fewer than prefetch
+        files on disk), so if processing is slower the downloads wait for it.
+        """
+        jobs = self.runner.get_jobs(self.savedir)
+        #files that were already there are not ours to delete
+        there = set([job[1] for job in jobs if os.path.exists(job[1])])
+
+        t0 = time.perf_counter()
+        self.stats = {'granules':0,'failed':0,'bytes':0,'download_seconds':0.,'process_seconds':0.}
+        todo = list(jobs)
+        downloading = set()
+        processing = set()
+        executor = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.runner.n_workers) as fetchers, executor(max_workers=self.n_workers) as workers:
+            while (len(todo) > 0) or (len(downloading) > 0) or (len(processing) > 0):
+                #backpressure: everything downloading or processing is (or will be) on disk
+                while (len(todo) > 0) and (len(downloading) < self.runner.n_workers) and \
+                      (len(downloading) + len(processing) < self.prefetch):
+                    future = fetchers.submit(self.runner.download_one,todo.pop(0),self.retries)
+                    downloading.add(future)
+                done,_ = wait(downloading | processing,return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in downloading:
+                        downloading.discard(future)
+                        result = future.result()
+                        self.downloads[result.path] = result
+                        self.stats['bytes'] += result.nbytes
+                        self.stats['download_seconds'] += result.seconds
+                        if not result.ok:
+                            print('Warning, could not download {}: {}'.format(result.url,result.error))
+                            self.stats['failed'] += 1
+                            continue
+                        future = workers.submit(timed,self.process,result.path)
+                        future.path = result.path
+                        processing.add(future)
+                    else:
+                        processing.discard(future)
+                        try:
+                            self.results[future.path],seconds = future.result()
+                            self.stats['process_seconds'] += seconds
+                            self.stats['granules'] += 1
+                        except Exception as e:
+                            print('Warning, could not process {}: {}'.format(future.path,e))
+                            self.stats['failed'] += 1
+                        if (not self.keep) and (future.path not in there):
+                            os.remove(future.path)
+
+        seconds = time.perf_counter() - t0
+        self.stats['seconds'] = seconds
+        if self.runner.verbose:
+            print('Processed {granules} granules in {seconds:.1f} s ({download_seconds:.1f} s downloading, '
+                  '{process_seconds:.1f} s processing)'.format(**self.stats))
+        return self.results
@@ -0,0 +1,503 @@
+"""
+A small HTTP client for the PPS servers, built on http.client so nothing extra has to be installed.
+
+Connections are kept open (keep-alive) and reused, with at most max_per_host open to each server at a time,
+so listing a folder and then downloading a bunch of files does not redo the TLS handshake for every request.
+Files are streamed straight to disk in big blocks and every download gives back a real status. Downloads that
+die partway are picked up where they left off, and files are checked (size, checksum, HDF5 signature) before
+they show up under their real name. Files can also be fetched straight into memory (fetch), without touching disk.
+"""
+from __future__ import absolute_import
+import base64
+import collections
+import contextlib
+import hashlib
+import http.client
+import io
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+#status of one download. status is the HTTP status (or None if it never got one), ok is True if the whole file made it
+#and checked out, nbytes is what was transferred this time, resumed is the bytes already there from an earlier try 
+#and skipped is True if the file was already complete
+DownloadResult = collections.namedtuple('DownloadResult',['url','path','ok','status','nbytes','seconds','error','resumed','skipped'])
+
+#every HDF5 file starts with this
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+#what HDF5 granules end in (Research and NearRealTime)
+HDF5_ENDINGS = ('.HDF5','.RT-H5')
+
+def content_range_start(header):
+    """ first byte of a 'bytes first-last/total' Content-Range """
+    match = re.match(r'bytes (\d+)-',header or '')
+    return None if match is None else int(match.group(1))
+
+def content_range_total(header):
+    """ total size from a 'bytes first-last/total' (or 'bytes */total') Content-Range """
+    match = re.match(r'bytes [^/]*/(\d+)',header or '')
+    return None if match is None else int(match.group(1))
+
+def file_checksum(path,algorithm='md5'):
+    """ hex digest of a file """
+    h = hashlib.new(algorithm)
+    with open(path,'rb') as f:
+        for block in iter(lambda: f.read(2**22),b''):
+            h.update(block)
+    return h.hexdigest()
+
+def check_bytes(data,name='',size=None,checksum=None):
+    """ same as verify, for a file that is in memory (bytes or a memoryview) """
+    n = len(data)
+    if (size is not None) and (n != size):
+        return 'size is {} not {}'.format(n,size)
+    if name.upper().endswith(HDF5_ENDINGS) and (bytes(data[:8]) != HDF5_SIGNATURE):
+        return 'not an HDF5 file'
+    if checksum is not None:
+        algorithm,digest = checksum.split(':',1) if ':' in checksum else ('md5',checksum)
+        if hashlib.new(algorithm,data).hexdigest().lower() != digest.lower():
+            return '{} checksum does not match'.format(algorithm)
+    return None
+
+def verify(path,size=None,checksum=None):
+    """
+    Check a downloaded file: its size, its checksum ('algorithm:hexdigest', plain hex is taken as md5) and, for 
+    .HDF5 (and .RT-H5) files, that it starts like an HDF5 file. Returns None if it is good, otherwise what is wrong with it.
+    """
+    n = os.path.getsize(path)
+    if (size is not None) and (n != size):
+        return 'size is {} not {}'.format(n,size)
+    if path.upper().endswith(HDF5_ENDINGS + tuple([ending + '.PART' for ending in HDF5_ENDINGS])):
+        with open(path,'rb') as f:
+            if f.read(8) != HDF5_SIGNATURE:
+                return 'not an HDF5 file'
+    if checksum is not None:
+        algorithm,digest = checksum.split(':',1) if ':' in checksum else ('md5',checksum)
+        if file_checksum(path,algorithm).lower() != digest.lower():
+            return '{} checksum does not match'.format(algorithm)
+    return None
+
+def owned(path):
+    """ is path only linked from here? A file that is also linked somewhere else (e.g., from a GranuleMirror) must not be written into """
+    return os.stat(path).st_nlink == 1
+
+def keep_existing(path,size=None,checksum=None):
+    """
+    Is the file already at path complete? That can only be told if its size or checksum is known. If it is not (or can 
+    not be checked), it is moved to path + '.part' (unless there already is one) so the download picks up from where 
+    it ends. A file that is linked somewhere else (see owned) is deleted instead, the download then starts over. 
+    Returns True if it can be kept as is. 
+    """
+    if ((size is not None) or (checksum is not None)) and (verify(path,size,checksum) is None):
+        return True
+    if not owned(path):
+        os.remove(path)
+    elif not os.path.exists(path + '.part'):
+        os.replace(path,path + '.part')
+    return False
+
+def plan_response(part,start,status,reason,content_range=None,content_length=None):
+    """
+    Work out what to do with the response to a (possibly ranged) GET before reading its body. 
+
+    returns (start, total, outcome). If outcome is None the body should be written to part from start on, otherwise it
+    is what receive should give back right away: (status, bytes written, total size of the file, error, True if trying
+    again would not help)
+    """
+    if status == 416:
+        #nothing left to get, check what we have 
+        total = content_range_total(content_range)
+        if (total is not None) and (start == total):
+            return start,total,(status,0,total,None,False)
+        part.discard()
+        return start,total,(status,0,total,'416 with a .part of {} bytes, starting over'.format(start),False)
+    if status == 206:
+        first = content_range_start(content_range)
+        if first != start:
+            part.discard()
+            return start,None,(status,0,None,'server sent bytes from {} not {}'.format(first,start),False)
+        return start,content_range_total(content_range),None
+    if status == 200:
+        #no resume (or the server ignored the Range), get the whole thing 
+        return 0,None if content_length is None else int(content_length),None
+    #4xx won't get better by asking again, 5xx might 
+    return start,None,(status,0,None,'{} {}'.format(status,reason),(400 <= status < 500))
+
+def finish_response(status,start,n,total):
+    """ what receive gives back once the body is written (see plan_response) """
+    if (total is not None) and (start + n != total):
+        return status,n,total,'only got {} of {} bytes'.format(start + n,total),False
+    return status,n,total,None,False
+
+class Part():
+
+    """ where a download goes while it comes in, a .part file next to path. Moved to path once it checks out """
+
+    def __init__(self,path):
+        self.path = path
+        self.tmp = path + '.part'
+
+    def size(self):
+        """ bytes already in. A .part that is linked somewhere else is not ours to add to, so it is thrown away """
+        if os.path.exists(self.tmp) and not owned(self.tmp):
+            self.discard()
+        return os.path.getsize(self.tmp) if os.path.exists(self.tmp) else 0
+
+    def open(self,start):
+        """ file to write the bytes from start on to. Starting over makes a new file rather than emptying the old one """
+        if start == 0:
+            self.discard()
+        return open(self.tmp,'ab' if start > 0 else 'wb')
+
+    def check(self,size=None,checksum=None):
+        return verify(self.tmp,size,checksum)
+
+    def discard(self):
+        """ throw away what came in, to start over """
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+    def finish(self):
+        os.replace(self.tmp,self.path)
+        return self.path
+
+class MemoryPart(Part):
+
+    """ a download into memory (an io.BytesIO named after the file) """
+
+    def __init__(self,name):
+        self.path = None
+        self.buffer = io.BytesIO()
+        self.buffer.name = name
+
+    def size(self):
+        return self.buffer.seek(0,2)
+
+    def open(self,start):
+        self.buffer.seek(start)
+        self.buffer.truncate()
+        return contextlib.nullcontext(self.buffer)
+
+    def check(self,size=None,checksum=None):
+        with self.buffer.getbuffer() as view:
+            return check_bytes(view,self.buffer.name,size,checksum)
+
+    def discard(self):
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def finish(self):
+        self.buffer.seek(0)
+        return self.buffer
+
+class Tries():
+
+    """
+    Bookkeeping of one download over all its tries (what came in, the last status and error, when to give up), so
+    HTTPPool and the asyncio client (drpy.io.aio) only have to do the talking. Iterate over it to get the tries::
+
+        for attempt in tries:
+            wait tries.delay(attempt) seconds
+            start = tries.start(attempt)
+            send the request with tries.headers(start), then tries.dropped(...) or tries.received(...)
+            if that returns True, tries.checked(tries.part.check(tries.expected(),checksum))
+    """
+
+    def __init__(self,part,size=None,retries=3,backoff=1.0):
+        """
+        params::
+        part: Part or MemoryPart, where the download goes
+        size: int, bytes the file should have (None to go with what the server says)
+        retries: int, times to try again
+        backoff: float, the first retry is right away, then wait this many seconds (doubling each time)
+        """
+        self.part = part
+        self.size = size
+        self.retries = retries
+        self.backoff = backoff
+        self.status = None
+        self.nbytes = 0
+        self.resumed = 0
+        self.total = None
+        self.error = None
+        self.output = None
+        self.done = False
+        self.t0 = time.perf_counter()
+
+    def __iter__(self):
+        for attempt in range(self.retries + 1):
+            if self.done:
+                return
+            yield attempt
+
+    def delay(self,attempt):
+        return 0. if attempt < 2 else self.backoff*2**(attempt - 2)
+
+    def start(self,attempt):
+        """ where this try picks up """
+        start = self.part.size()
+        if attempt == 0:
+            self.resumed = start
+        return start
+
+    def headers(self,start):
+        return {'Range':'bytes={}-'.format(start)} if start > 0 else None
+
+    def dropped(self,e,start):
+        """ the connection dropped, whatever made it is kept """
+        self.nbytes += max(self.part.size() - start,0)
+        self.error = repr(e)
+
+    def received(self,status,n,total,error,fatal):
+        """ a response came back (what receive returns). Returns True if the file is all in and should be checked """
+        self.status = status
+        self.nbytes += n
+        self.total = total
+        self.error = error
+        if fatal:
+            self.done = True
+        return (not fatal) and (error is None)
+
+    def expected(self):
+        """ the size the file should have """
+        return self.size if self.size is not None else self.total
+
+    def checked(self,error):
+        """ what the check found. A good file is moved into place, a bad one is thrown away to start over """
+        self.error = error
+        if error is None:
+            self.output = self.part.finish()
+            self.done = True
+        else:
+            self.part.discard()
+
+    def result(self,url):
+        return DownloadResult(url,self.part.path,self.error is None,self.status,self.nbytes,time.perf_counter() - self.t0,
+                              self.error,self.resumed,False)
+
+class HTTPPool():
+
+    """
+    A pool of keep-alive HTTP(S) connections, shared by many threads. Each host gets at most max_per_host
+    connections, requests past that wait for one to free up.
+    """
+
+    def __init__(self,username=None,password=None,max_per_host=4,timeout=60,buffer_size=2**20):
+        """
+        params::
+        username: str, PPS registered email (PPS uses it as the password too)
+        password: str, defaults to the username
+        max_per_host: int, most connections open to one host at a time
+        timeout: float, seconds to wait on a socket before giving up
+        buffer_size: int, bytes read from the socket (and written to disk) at a time
+        """
+        self.headers = {'Connection':'keep-alive','User-Agent':'drpy'}
+        if username is not None:
+            if password is None:
+                password = username
+            token = base64.b64encode('{}:{}'.format(username,password).encode()).decode()
+            self.headers['Authorization'] = 'Basic ' + token
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.buffer_size = buffer_size
+        self.lock = threading.Lock()
+        self.idle = collections.defaultdict(list)
+        self.slots = {}
+
+    def slot(self,host):
+        """ the semaphore that limits the connections to one host """
+        with self.lock:
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.slots[host]
+
+    def connect(self,scheme,host):
+        """ an idle connection to host if there is one, otherwise a new one """
+        with self.lock:
+            if len(self.idle[(scheme,host)]) > 0:
+                return self.idle[(scheme,host)].pop()
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host,timeout=self.timeout)
+        return http.client.HTTPConnection(host,timeout=self.timeout)
+
+    def release(self,scheme,host,conn,response):
+        """ hand a connection back to the pool, unless the server said it is closing it (or hung up partway) """
+        if response.will_close or (response.getheader('Connection','').lower() == 'close') or bool(response.length):
+            conn.close()
+            return
+        with self.lock:
+            self.idle[(scheme,host)].append(conn)
+
+    def request(self,url,handle,method='GET',headers=None):
+        """
+        Send one request and pass the response to handle(response), while holding one of the host's connections.
+        A connection the server already dropped is retried once on a fresh one.
+
+        returns whatever handle returns
+        """
+        parts = urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        h = dict(self.headers)
+        if headers is not None:
+            h.update(headers)
+        with self.slot(parts.netloc):
+            for attempt in range(2):
+                conn = self.connect(parts.scheme,parts.netloc)
+                try:
+                    conn.request(method,path,headers=h)
+                    response = conn.getresponse()
+                except (http.client.RemoteDisconnected,ConnectionResetError,BrokenPipeError,http.client.CannotSendRequest):
+                    #a kept-alive connection that timed out on the server side, try again with a new one
+                    conn.close()
+                    if attempt == 1:
+                        raise
+                    continue
+                except Exception:
+                    conn.close()
+                    raise
+                try:
+                    result = handle(response)
+                    #read whatever is left (a block at a time, it could be a whole granule) so the connection can be used again
+                    while response.read(self.buffer_size):
+                        pass
+                except Exception:
+                    conn.close()
+                    raise
+                self.release(parts.scheme,parts.netloc,conn,response)
+                return result
+
+    def get_text(self,url):
+        """ GET a (text) page. Raises IOError if the server does not give back 200 """
+        def handle(response):
+            body = response.read()
+            if response.status != 200:
+                raise IOError('{} {} for {}'.format(response.status,response.reason,url))
+            return body.decode('utf-8','replace')
+        return self.request(url,handle)
+
+    def remote_size(self,url):
+        """ size of a file on the server (from a HEAD request), None if the server does not say """
+        def handle(response):
+            if response.status != 200:
+                return None
+            n = response.getheader('Content-Length')
+            return None if n is None else int(n)
+        try:
+            return self.request(url,handle,method='HEAD')
+        except Exception:
+            return None
+
+    def download(self,url,path,size=None,checksum=None,retries=3,backoff=1.0,progress=None):
+        """
+        Stream url to path. Data are written to path + '.part' and moved to path once the whole file is in and checks out.
+
+        If path is already there and checks out (its size or checksum has to be known for that) it is skipped. If a .part 
+        is left over from a download that died (or path is there but could not be checked), only the missing bytes 
+        are asked for (HTTP Range) and added on the end. 
+
+        params::
+        url: str, what to download
+        path: str, where to put it
+        size: int, bytes the file should have (e.g., from the listing). If None the server's size is used
+        checksum: str, 'algorithm:hexdigest' (e.g., 'md5:0cc1...') the file should have, None to not check
+        retries: int, times to try again (picking up where it left off) if the connection drops
+        backoff: float, the first retry is right away, then wait this many seconds (doubling each time)
+        progress: function(nbytes_so_far,nbytes_total) called after every block (total is None if unknown)
+
+        returns a DownloadResult
+        """
+        t0 = time.perf_counter()
+        #skip it if we already have the whole thing (see keep_existing) 
+        if os.path.exists(path):
+            expected = size if size is not None else self.remote_size(url)
+            if keep_existing(path,expected,checksum):
+                return DownloadResult(url,path,True,None,0,time.perf_counter() - t0,None,0,True)
+        tries = Tries(Part(path),size,retries,backoff)
+        self.attempt(url,tries,checksum,progress)
+        return tries.result(url)
+
+    def fetch(self,url,size=None,checksum=None,retries=3,backoff=1.0,progress=None):
+        """
+        Like download, but the file goes into memory instead of onto disk. If the connection drops, only the missing 
+        bytes are asked for again. The buffer is named after the file (buffer.name) so GPMDPR can tell what it is. 
+
+        params::
+        url: str, what to download
+        size: int, bytes the file should have (e.g., from the listing). If None the server's size is used
+        checksum: str, 'algorithm:hexdigest' the file should have, None to not check
+        retries: int, times to try again (picking up where it left off) if the connection drops
+        backoff: float, the first retry is right away, then wait this many seconds (doubling each time)
+        progress: function(nbytes_so_far,nbytes_total) called after every block (total is None if unknown)
+
+        returns (DownloadResult, io.BytesIO). The buffer is None if the download failed 
+        """
+        tries = Tries(MemoryPart(os.path.basename(urlsplit(url).path)),size,retries,backoff)
+        self.attempt(url,tries,checksum,progress)
+        return tries.result(url),tries.output
+
+    def attempt(self,url,tries,checksum=None,progress=None):
+        """ the tries of one download (see Tries), picking up where the last one left off each time """
+        for attempt in tries:
+            time.sleep(tries.delay(attempt))
+            start = tries.start(attempt)
+            try:
+                outcome = self.request(url,lambda response: self.receive(response,tries.part,start,progress),
+                                       headers=tries.headers(start))
+            except Exception as e:
+                tries.dropped(e,start)
+                continue
+            if tries.received(*outcome):
+                tries.checked(tries.part.check(tries.expected(),checksum))
+
+    def receive(self,response,part,start,progress=None):
+        """
+        Write the body of a (possibly ranged) response to part (a Part or MemoryPart that already has start bytes in it). 
+
+        returns (status, bytes written, total size of the file, error, True if trying again would not help)
+        """
+        start,total,outcome = plan_response(part,start,response.status,response.reason,response.getheader('Content-Range'),
+                                            response.getheader('Content-Length'))
+        if outcome is not None:
+            return outcome
+        n = 0
+        with part.open(start) as f:
+            while True:
+                block = response.read(self.buffer_size)
+                if not block:
+                    break
+                f.write(block)
+                n += len(block)
+                if progress is not None:
+                    progress(start + n,total)
+        return finish_response(response.status,start,n,total)
+
+    def download_many(self,jobs,n_workers=4,callback=None,**kwargs):
+        """
+        Download lots of files at the same time.
+
+        params::
+        jobs: list of (url,path) or (url,path,size,checksum)
+        n_workers: int, number of downloads going at once (each host is still capped at max_per_host)
+        callback: function(DownloadResult) called as each one finishes
+        anything else is passed on to download (e.g., retries)
+
+        returns a list of DownloadResult in the same order as jobs
+        """
+        def work(job):
+            result = self.download(*job,**kwargs)
+            if callback is not None:
+                callback(result)
+            return result
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            return list(pool.map(work,jobs))
+
+    def close(self):
+        """ close all the idle connections """
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle.clear()
@@ -1,2 +1,3 @@
 from __future__ import absolute_import
-from .util import boxbin
\ No newline at end of file
+from .util import boxbin
+from . import geo
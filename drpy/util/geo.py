@@ -0,0 +1,108 @@
+"""
+Distances on the earth for GPM-DPR swaths. Everything here works on whole numpy arrays at once
+(no python loops over rays) and gives distances in km.
+
+Two ways to get the distance to a reference point are here:
+
+#. 'aeqd', the distance in an azimuthal equidistant projection centered on the reference point (WGS84).
+   This is what DRpy has always used. The pyproj Transformer for each reference point is built once and kept around.
+#. 'haversine', great circle distance on a sphere. Pure numpy, so no pyproj needed, and a bit faster.
+   It differs from 'aeqd' by a few tenths of a percent.
+"""
+from __future__ import absolute_import
+import functools
+import numpy as np
+
+#mean radius of the earth [km]
+EARTH_RADIUS = 6371.0088
+
+def mask_fill(lon,lat):
+    """
+    lon/lat as float64 with anything that can't be a coordinate (GPM's -9999.9 fill value, nans) set to nan. The reader
+    keeps the raw values, so the fill values are still in Longitude/Latitude.
+    """
+    lon = np.asarray(lon,dtype=np.float64)
+    lat = np.asarray(lat,dtype=np.float64)
+    bad = ~((lat >= -90) & (lat <= 90) & (lon >= -180) & (lon <= 360))
+    return np.where(bad,np.nan,lon),np.where(bad,np.nan,lat)
+
+def haversine(lon0,lat0,lon,lat):
+    """
+    Great circle distance [km] between (lon0,lat0) and (lon,lat). All inputs are in degrees and broadcast
+    against each other like any numpy op, so one point vs. a whole swath (or many points vs. a swath) works.
+    """
+    lon0,lat0,lon,lat = map(np.radians,(lon0,lat0,lon,lat))
+    a = np.sin((lat - lat0)/2)**2 + np.cos(lat0)*np.cos(lat)*np.sin((lon - lon0)/2)**2
+    return 2*EARTH_RADIUS*np.arcsin(np.sqrt(np.clip(a,0,1)))
+
+@functools.lru_cache(maxsize=128)
+def get_transformer(lon0,lat0):
+    """
+    A pyproj Transformer from lon/lat to an azimuthal equidistant projection centered on (lon0,lat0).
+    These are slow to make, so they are cached. Needs pyproj >= 2.2
+    """
+    from pyproj import CRS, Transformer
+    aeqd = CRS(proj='aeqd',ellps='WGS84',datum='WGS84',lat_0=lat0,lon_0=lon0)
+    return Transformer.from_crs(CRS('EPSG:4326'),aeqd,always_xy=True)
+
+def aeqd_distance(lon0,lat0,lon,lat):
+    """ distance [km] from (lon0,lat0) to every (lon,lat), in an azimuthal equidistant projection """
+    lon = np.asarray(lon,dtype=np.float64)
+    lat = np.asarray(lat,dtype=np.float64)
+    x,y = get_transformer(float(lon0),float(lat0)).transform(lon,lat)
+    d = np.hypot(x,y)/1000
+    #anything that did not project (e.g., nans) stays nan
+    return np.where(np.isfinite(d),d,np.nan)
+
+def distance_from(lon,lat,reference_points,method='aeqd'):
+    """
+    Distance [km] from one or many reference points to every lon/lat.
+
+    params::
+    lon: array, longitudes [deg]
+    lat: array, latitudes [deg], same shape as lon
+    reference_points: [lon,lat] or array of shape (npoint,2)
+    method: str, 'aeqd' or 'haversine' (see the top of this module)
+
+    returns an array with shape (npoint,) + lon.shape, or lon.shape if only one point was given (nan where lon/lat are missing)
+    """
+    points = np.asarray(reference_points,dtype=np.float64)
+    single = points.ndim == 1
+    points = np.atleast_2d(points)
+    lon,lat = mask_fill(lon,lat)
+
+    if method == 'haversine':
+        expand = (slice(None),) + (np.newaxis,)*lon.ndim
+        d = haversine(points[:,0][expand],points[:,1][expand],lon,lat)
+    elif method == 'aeqd':
+        d = np.stack([aeqd_distance(p[0],p[1],lon,lat) for p in points])
+    else:
+        raise ValueError("Unknown method {}, pick 'aeqd' or 'haversine'".format(method))
+
+    return d[0] if single else d
+
+def along_track_distance(lon,lat,axis=0):
+    """
+    Cumulative distance [km] along the track (the nscan axis) for every ray, starting at 0 on the first scan.
+    Scans with missing lat/lon (nan or the fill value, see mask_fill) are nan and are jumped over, so the distance 
+    keeps counting on the other side.
+    """
+    lon,lat = mask_fill(lon,lat)
+    lon = np.moveaxis(lon,axis,0)
+    lat = np.moveaxis(lat,axis,0)
+    good = np.isfinite(lon) & np.isfinite(lat)
+
+    #carry the last good lat/lon forward so each step is measured from the last good scan
+    index = np.arange(lon.shape[0]).reshape((-1,) + (1,)*(lon.ndim-1))
+    last = np.maximum.accumulate(np.where(good,index,0),axis=0)
+    lon_f = np.take_along_axis(lon,last,axis=0)
+    lat_f = np.take_along_axis(lat,last,axis=0)
+
+    step = np.zeros(lon.shape)
+    step[1:] = haversine(lon_f[:-1],lat_f[:-1],lon[1:],lat[1:])
+    #bad scans (and the first good one, which has nothing good before it) add nothing
+    step[~np.isfinite(step)] = 0
+
+    d = np.cumsum(step,axis=0)
+    d[~good] = np.nan
+    return np.moveaxis(d,0,axis)